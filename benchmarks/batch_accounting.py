@@ -0,0 +1,33 @@
+"""Per-call cost of Batch quantity accounting as allocations grow.
+
+    python benchmarks/batch_accounting.py
+"""
+import timeit
+from allocation.domain.model import Batch, OrderLine
+
+SIZES = [10, 100, 1_000, 10_000]
+CALLS = 10_000
+
+
+def make_batch(allocations: int) -> Batch:
+    batch = Batch("batch", "SKU", qty=allocations + 1, eta=None)
+    for i in range(allocations):
+        batch.allocate(OrderLine(f"order-{i}", "SKU", 1))
+    return batch
+
+
+def main():
+    probe = OrderLine("probe", "SKU", 1)
+    print(f"{'allocations':>12} {'can_allocate':>14} {'available':>14}")
+    for size in SIZES:
+        batch = make_batch(size)
+        can_allocate = timeit.timeit(lambda: batch.can_allocate(probe), number=CALLS)
+        available = timeit.timeit(lambda: batch.available_quantity, number=CALLS)
+        print(
+            f"{size:>12} {can_allocate / CALLS * 1e9:>11.0f} ns"
+            f" {available / CALLS * 1e9:>11.0f} ns"
+        )
+
+
+if __name__ == "__main__":
+    main()
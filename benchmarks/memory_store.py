@@ -0,0 +1,58 @@
+"""Per-command latency of the in-memory store against SQLAlchemy on SQLite.
+
+    python benchmarks/memory_store.py [orders]
+
+Both run through the command handlers, since bootstrap won't build a bus
+around the in-memory store; SQLite is a local file, so this is the
+cheapest a SQLAlchemy round trip gets.  The in-memory store fsyncs its log
+every FSYNC_INTERVAL seconds in the background.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+from allocation.adapters import orm
+from allocation.adapters.memory_store import ProductStore
+from allocation.domain import commands
+from allocation.service_layer import handlers, unit_of_work
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+SKUS = 10
+
+
+def run(uow):
+    for s in range(SKUS):
+        handlers.add_batch(
+            commands.CreateBatch(f"batch-{s}", f"sku-{s}", ORDERS, None), uow
+        )
+    started = time.perf_counter()
+    for i in range(ORDERS):
+        handlers.allocate(commands.Allocate(f"order-{i}", f"sku-{i % SKUS}", 1), uow)
+    return (time.perf_counter() - started) / ORDERS
+
+
+def main():
+    directory = tempfile.mkdtemp()
+
+    store = ProductStore(os.path.join(directory, "store"))
+    in_memory = run(unit_of_work.InMemoryUnitOfWork(store))
+    store.close()
+
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'allocation.db')}")
+    orm.metadata.create_all(engine)
+    orm.start_mappers()
+    try:
+        sqlalchemy = run(unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine)))
+    finally:
+        clear_mappers()
+
+    print(f"{'store':>12} {'us/allocate':>12}")
+    print(f"{'in-memory':>12} {in_memory * 1e6:>12.0f}")
+    print(f"{'sqlalchemy':>12} {sqlalchemy * 1e6:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Queries and time to load a Product under each ORM loading strategy.
+
+    python benchmarks/orm_loading.py [db_uri]
+
+Defaults to in-memory SQLite, where queries are nearly free; against a
+networked database (e.g. the docker-compose Postgres) each extra query is
+a round trip, so the query count matters more than the timing shown here.
+"""
+
+import sys
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import clear_mappers, sessionmaker
+from allocation.adapters import orm, repository
+from allocation.domain import model
+
+DB_URI = sys.argv[1] if len(sys.argv) > 1 else "sqlite://"
+SHAPES = [(1, 10), (10, 10), (10, 100), (50, 100), (100, 200)]
+LOADS = 20
+
+
+def populate(session_factory, batches, allocations_per_batch):
+    session = session_factory()
+    product = model.Product("SKU", batches=[])
+    for b in range(batches):
+        batch = model.Batch(f"batch-{b}", "SKU", allocations_per_batch, eta=None)
+        for i in range(allocations_per_batch):
+            batch.allocate(model.OrderLine(f"order-{b}-{i}", "SKU", 1))
+        product.add_batch(batch)
+    session.add(product)
+    session.commit()
+    session.close()
+
+
+def load(session_factory):
+    session = session_factory()
+    product = repository.SqlAlchemyRepository(session).get("SKU")
+    sum(b.available_quantity for b in product.batches)
+    session.close()
+
+
+def measure(loading, batches, allocations_per_batch):
+    engine = create_engine(DB_URI)
+    orm.metadata.drop_all(engine)
+    orm.metadata.create_all(engine)
+    orm.start_mappers(loading)
+    try:
+        session_factory = sessionmaker(bind=engine)
+        populate(session_factory, batches, allocations_per_batch)
+        queries = []
+        event.listen(engine, "before_cursor_execute", lambda *_: queries.append(1))
+        started = time.perf_counter()
+        for _ in range(LOADS):
+            load(session_factory)
+        elapsed = (time.perf_counter() - started) / LOADS
+        return len(queries) // LOADS, elapsed
+    finally:
+        clear_mappers()
+        orm.metadata.drop_all(engine)
+
+
+def main():
+    print(f"{'batches':>8} {'allocs':>8} {'loading':>9} {'queries':>8} {'ms':>8}")
+    for batches, allocations_per_batch in SHAPES:
+        for loading in orm.LOADING_STRATEGIES:
+            queries, elapsed = measure(loading, batches, allocations_per_batch)
+            print(
+                f"{batches:>8} {batches * allocations_per_batch:>8} {loading:>9}"
+                f" {queries:>8} {elapsed * 1e3:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Bytes per order line held by a loaded Product, measured with tracemalloc.
+
+    python benchmarks/product_memory.py [lines]
+"""
+import sys
+import tracemalloc
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from allocation.adapters import orm, repository
+from allocation.domain import commands, events, model
+
+LINES = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+BATCHES = 20
+
+
+def populate(session_factory):
+    session = session_factory()
+    per_batch = LINES // BATCHES
+    batches = []
+    for b in range(BATCHES):
+        batch = model.Batch(f"batch-{b}", "SKU", qty=per_batch, eta=None)
+        for i in range(per_batch):
+            batch.allocate(model.OrderLine(f"order-{b}-{i}", "SKU", 1))
+        batches.append(batch)
+    session.add(model.Product("SKU", batches))
+    session.commit()
+    session.close()
+
+
+def measure(build):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    kept = build()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return kept, after - before
+
+
+def load_product(session_factory):
+    session = session_factory()
+    product = repository.SqlAlchemyRepository(session).get("SKU")
+    lines = sum(len(b._allocations) for b in product.batches)
+    return session, product, lines
+
+
+def main():
+    engine = create_engine("sqlite://")
+    orm.metadata.create_all(engine)
+    orm.start_mappers()
+    session_factory = sessionmaker(bind=engine)
+    populate(session_factory)
+
+    (_, _, lines), used = measure(lambda: load_product(session_factory))
+    print(f"loaded product: {lines} lines, {used / lines:.0f} bytes/line")
+
+    for message in [
+        lambda i: commands.Allocate(f"order-{i}", "SKU", 1),
+        lambda i: events.Allocated(f"order-{i}", "SKU", 1, "batch"),
+    ]:
+        kept, used = measure(lambda: [message(i) for i in range(LINES)])
+        print(f"{type(kept[0]).__name__}: {used / LINES:.0f} bytes/message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Applying Allocated events to allocations_view one at a time, as the bus
+handlers used to, against the projector's batches.
+
+    python benchmarks/projector.py [events]
+
+SQLite is a local file, so this understates what a round trip per event
+costs against Postgres.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from allocation.adapters import orm
+from allocation.entrypoints import projector
+
+EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+
+
+def allocated(i):
+    return dict(orderid=f"order-{i}", sku=f"sku-{i % 10}", qty=1, batchref="b1")
+
+
+def one_at_a_time(session_factory):
+    started = time.perf_counter()
+    for i in range(EVENTS):
+        session = session_factory()
+        event = allocated(i)
+        session.execute(
+            orm.allocations_view.insert().values(
+                orderid=event["orderid"], sku=event["sku"], batchref=event["batchref"]
+            )
+        )
+        session.commit()
+        session.close()
+    return time.perf_counter() - started
+
+
+def batched(session_factory):
+    session = session_factory()
+    session.execute(
+        orm.projection_queue.insert(),
+        [
+            dict(event_type="Allocated", payload=json.dumps(allocated(i)))
+            for i in range(EVENTS)
+        ],
+    )
+    session.commit()
+    started = time.perf_counter()
+    while projector.project(session_factory):
+        pass
+    return time.perf_counter() - started
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    results = {}
+    for name, apply in (("one-at-a-time", one_at_a_time), ("batched", batched)):
+        engine = create_engine(f"sqlite:///{os.path.join(directory, name)}.db")
+        orm.metadata.create_all(engine)
+        results[name] = apply(sessionmaker(bind=engine))
+
+    print(f"{'projection':>14} {'us/event':>10}")
+    for name, elapsed in results.items():
+        print(f"{name:>14} {elapsed / EVENTS * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
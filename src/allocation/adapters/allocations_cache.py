@@ -0,0 +1,198 @@
+import abc
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+import redis
+
+from allocation import config
+from allocation.adapters.metrics import AbstractMetrics, NullMetrics
+
+Allocations = List[Dict[str, str]]
+Entry = Tuple[float, Allocations]
+
+MAX_ENTRIES = 10_000
+TTL = 300
+# an order that isn't in the view yet is usually about to be
+EMPTY_TTL = 5
+
+
+class AbstractAllocationsCache(abc.ABC):
+    """Results of views.allocations by orderid.  Entries are invalidated by
+    the projector as it applies changes.  A lookup takes the generation
+    before it reads, and its set is dropped if the entry was invalidated
+    since, so a read that raced the projector can't be cached."""
+
+    metrics: AbstractMetrics = NullMetrics()
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, orderid: str) -> Optional[Allocations]:
+        allocations = self._get(orderid)
+        if allocations is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self.metrics.increment(
+            "allocations_cache_lookups_total",
+            result="miss" if allocations is None else "hit",
+        )
+        return allocations
+
+    @abc.abstractmethod
+    def _get(self, orderid: str) -> Optional[Allocations]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def generation(self, orderid: str) -> Optional[int]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set(self, orderid: str, allocations: Allocations, generation: Optional[int]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def invalidate(self, orderid: str):
+        raise NotImplementedError
+
+
+class NullAllocationsCache(AbstractAllocationsCache):
+    def _get(self, orderid):
+        return None
+
+    def generation(self, orderid):
+        return None
+
+    def set(self, orderid, allocations, generation):
+        pass
+
+    def invalidate(self, orderid):
+        pass
+
+
+class InMemoryAllocationsCache(AbstractAllocationsCache):
+    """Least recently used out first.  Only kept correct when the projector
+    runs in the process that reads through it, as in tests."""
+
+    def __init__(
+        self,
+        max_entries: int = MAX_ENTRIES,
+        ttl: float = TTL,
+        empty_ttl: float = EMPTY_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # type: OrderedDict[str, Entry]
+        # when each orderid was last invalidated; those that have been
+        # dropped count as invalidated as late as the latest one dropped
+        self._invalidations = 0
+        self._invalidated = OrderedDict()  # type: OrderedDict[str, int]
+        self._forgotten = 0
+        self._lock = threading.Lock()
+
+    def _get(self, orderid):
+        with self._lock:
+            expires, allocations = self._entries.get(orderid, (0.0, None))
+            if allocations is None or expires <= self.clock():
+                self._entries.pop(orderid, None)
+                return None
+            self._entries.move_to_end(orderid)
+            return allocations
+
+    def generation(self, orderid):
+        with self._lock:
+            return self._invalidations
+
+    def set(self, orderid, allocations, generation):
+        with self._lock:
+            if self._invalidated.get(orderid, self._forgotten) > generation:
+                return
+            ttl = self.ttl if allocations else self.empty_ttl
+            self._entries[orderid] = (self.clock() + ttl, allocations)
+            self._entries.move_to_end(orderid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, orderid):
+        with self._lock:
+            self._entries.pop(orderid, None)
+            self._invalidations += 1
+            self._invalidated[orderid] = self._invalidations
+            self._invalidated.move_to_end(orderid)
+            while len(self._invalidated) > self.max_entries:
+                _, self._forgotten = self._invalidated.popitem(last=False)
+
+
+# sets the entry only if its generation is still the one the lookup read
+SET_IF_GENERATION = """
+if (redis.call("GET", KEYS[1]) or "") == ARGV[1] then
+    redis.call("SET", KEYS[2], ARGV[2], "EX", ARGV[3])
+end
+"""
+
+
+class RedisAllocationsCache(AbstractAllocationsCache):
+    def __init__(
+        self, client: redis.Redis, ttl: int = TTL, empty_ttl: int = EMPTY_TTL
+    ):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self._set_if_generation = client.register_script(SET_IF_GENERATION)
+
+    def _get(self, orderid):
+        cached = self.client.get(self._key(orderid))
+        return None if cached is None else json.loads(cached)
+
+    def generation(self, orderid):
+        generation = self.client.get(self._generation_key(orderid))
+        return None if generation is None else int(generation)
+
+    def set(self, orderid, allocations, generation):
+        self._set_if_generation(
+            keys=[self._generation_key(orderid), self._key(orderid)],
+            args=[
+                "" if generation is None else generation,
+                json.dumps(allocations),
+                self.ttl if allocations else self.empty_ttl,
+            ],
+        )
+
+    def invalidate(self, orderid):
+        # the generation expires with the entries; no lookup is still running
+        # by then to compare against it
+        pipe = self.client.pipeline()
+        pipe.incr(self._generation_key(orderid))
+        pipe.expire(self._generation_key(orderid), self.ttl)
+        pipe.delete(self._key(orderid))
+        pipe.execute()
+
+    def _key(self, orderid: str) -> str:
+        return f"allocations:{orderid}"
+
+    def _generation_key(self, orderid: str) -> str:
+        return f"allocations-generation:{orderid}"
+
+
+def default_allocations_cache() -> AbstractAllocationsCache:
+    # no in-process option: the projector runs in a process of its own, and
+    # couldn't invalidate it
+    kind = config.get_allocations_cache()
+    if kind == "redis":
+        return RedisAllocationsCache(redis.Redis(**config.get_redis_host_and_port()))
+    if kind == "none":
+        return NullAllocationsCache()
+    raise ValueError(f"Unknown allocations cache {kind}")
@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from allocation.domain import model
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT = "snapshot.json"
+LOG = "log.jsonl"
+FSYNC_INTERVAL = 0.01
+CHECKPOINT_EVERY = 10_000
+
+
+class VersionConflict(Exception):
+    pass
+
+
+class ProductStore:
+    """Committed products held in memory as plain data, made durable by an
+    append-only log of committed states plus periodic snapshots.
+
+    Each commit is one log line, handed to the OS before it is applied, so
+    a process crash loses nothing; the fsync is batched, so a machine
+    crash loses at most the last fsync_interval seconds of commits.  On
+    startup the snapshot is loaded and the log replayed over it.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        fsync_interval: float = FSYNC_INTERVAL,
+        checkpoint_every: int = CHECKPOINT_EVERY,
+    ):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.checkpoint_every = checkpoint_every
+        self._products = {}  # type: Dict[str, dict]
+        self._sku_by_batchref = {}  # type: Dict[str, str]
+        self._lock = threading.Lock()
+        self._unsynced = False
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._log = open(self._path(LOG), "ab", buffering=0)
+        self._closed = threading.Event()
+        self._syncer = threading.Thread(target=self._sync_periodically, daemon=True)
+        if fsync_interval:
+            self._syncer.start()
+
+    def get(self, sku: str) -> Optional[dict]:
+        return self._products.get(sku)
+
+    def sku_for_batchref(self, batchref: str) -> Optional[str]:
+        return self._sku_by_batchref.get(batchref)
+
+    def commit(self, changes: List[Tuple[dict, Optional[int]]]):
+        """Apply new product states, each given with the version it was
+        loaded at (None for new products), all or nothing."""
+        entry = (json.dumps([state for state, _ in changes]) + "\n").encode()
+        with self._lock:
+            for state, expected in changes:
+                current = self._products.get(state["sku"])
+                version = current["version_number"] if current else None
+                if version != expected:
+                    raise VersionConflict(f"{state['sku']} has changed")
+            end = self._log.tell()
+            try:
+                self._append(entry)
+            except OSError:
+                # don't leave half an entry for the next one to be appended to
+                os.ftruncate(self._log.fileno(), end)
+                raise
+            self._unsynced = True
+            if not self.fsync_interval:
+                self._fsync()
+            for state, _ in changes:
+                self._apply(state)
+            self._logged += 1
+            if self._logged >= self.checkpoint_every:
+                self._checkpoint()
+
+    def checkpoint(self):
+        with self._lock:
+            self._checkpoint()
+
+    def sync(self):
+        with self._lock:
+            self._fsync()
+
+    def close(self):
+        self._closed.set()
+        if self._syncer.is_alive():
+            self._syncer.join()
+        with self._lock:
+            self._fsync()
+            self._log.close()
+
+    def _recover(self):
+        if os.path.exists(self._path(SNAPSHOT)):
+            with open(self._path(SNAPSHOT), encoding="utf-8") as f:
+                for state in json.load(f):
+                    self._apply(state)
+        self._logged = 0
+        if not os.path.exists(self._path(LOG)):
+            return
+        with open(self._path(LOG), "r+", encoding="utf-8") as f:
+            valid_up_to = 0
+            for line in iter(f.readline, ""):
+                if not line.endswith("\n"):
+                    # a commit torn by a crash, so never acknowledged
+                    logger.warning("discarding torn log entry at %d", valid_up_to)
+                    f.truncate(valid_up_to)
+                    break
+                states = json.loads(line)
+                for state in states:
+                    self._apply(state)
+                self._logged += 1
+                valid_up_to = f.tell()
+
+    def _apply(self, state: dict):
+        current = self._products.get(state["sku"])
+        # replaying a log the last snapshot already covers must not go back
+        if current and current["version_number"] > state["version_number"]:
+            return
+        self._products[state["sku"]] = state
+        for batch in state["batches"]:
+            self._sku_by_batchref[batch["reference"]] = state["sku"]
+
+    def _checkpoint(self):
+        # the snapshot is in place before the log is emptied, and replaying
+        # an old log over a newer snapshot is harmless
+        tmp = self._path(SNAPSHOT + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(list(self._products.values()), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(SNAPSHOT))
+        self._fsync_directory()
+        os.ftruncate(self._log.fileno(), 0)
+        self._log.seek(0)
+        self._fsync()
+        self._logged = 0
+
+    def _sync_periodically(self):
+        while not self._closed.wait(self.fsync_interval):
+            with self._lock:
+                if self._unsynced:
+                    self._fsync()
+
+    def _append(self, entry: bytes):
+        written = 0
+        while written < len(entry):
+            written += self._log.write(entry[written:])
+
+    def _fsync(self):
+        os.fsync(self._log.fileno())
+        self._unsynced = False
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+
+def dump_product(product: model.Product) -> dict:
+    return {
+        "sku": product.sku,
+        "version_number": product.version_number,
+        "batches": [
+            {
+                "reference": batch.reference,
+                "sku": batch.sku,
+                "qty": batch._purchased_quantity,
+                "eta": batch.eta.isoformat() if batch.eta else None,
+                "allocations": [
+                    [line.orderid, line.sku, line.qty] for line in batch._allocations
+                ],
+            }
+            for batch in product.batches
+        ],
+    }
+
+
+def load_product(state: dict) -> model.Product:
+    batches = []
+    for b in state["batches"]:
+        eta = date.fromisoformat(b["eta"]) if b["eta"] else None
+        batch = model.Batch(b["reference"], b["sku"], b["qty"], eta)
+        batch._allocations.update(model.OrderLine(*line) for line in b["allocations"])
+        batch.reset_allocated_quantity()
+        batches.append(batch)
+    return model.Product(state["sku"], batches, state["version_number"])
@@ -0,0 +1,104 @@
+import abc
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)  # fmt: skip
+DEPTH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+BUCKETS = {
+    "messagebus_queue_depth_peak": DEPTH_BUCKETS,
+}  # type: Dict[str, Tuple[float, ...]]
+
+
+class AbstractMetrics(abc.ABC):
+    @abc.abstractmethod
+    def observe(self, name: str, value: float, **labels: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def increment(self, name: str, amount: float = 1, **labels: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def gauge(self, name: str, value: float, **labels: str):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return ""
+
+
+class NullMetrics(AbstractMetrics):
+    def observe(self, name, value, **labels):
+        pass
+
+    def increment(self, name, amount=1, **labels):
+        pass
+
+    def gauge(self, name, value, **labels):
+        pass
+
+
+class PrometheusMetrics(AbstractMetrics):
+    def __init__(self, buckets: Optional[Dict[str, Tuple[float, ...]]] = None):
+        self.buckets = {**BUCKETS, **(buckets or {})}
+        self.histograms = {}  # type: Dict[str, Dict[Labels, List[float]]]
+        self.counters = defaultdict(dict)  # type: Dict[str, Dict[Labels, float]]
+        self.gauges = defaultdict(dict)  # type: Dict[str, Dict[Labels, float]]
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        bounds = self.buckets.get(name, LATENCY_BUCKETS)
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            # one count per bucket, then +Inf, sum
+            values = series.setdefault(key, [0.0] * (len(bounds) + 2))
+            values[bisect_left(bounds, value)] += 1
+            values[-1] += value
+
+    def increment(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.counters[name][key] = self.counters[name].get(key, 0) + amount
+
+    def gauge(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.gauges[name][key] = value
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.histograms.items()):
+                bounds = self.buckets.get(name, LATENCY_BUCKETS)
+                lines.append(f"# TYPE {name} histogram")
+                for key, values in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(bounds + ("+Inf",), values):
+                        cumulative += int(count)
+                        le = (("le", str(bound)),)
+                        lines.append(f"{name}_bucket{_format(key + le)} {cumulative}")
+                    lines.append(f"{name}_sum{_format(key)} {values[-1]}")
+                    lines.append(f"{name}_count{_format(key)} {cumulative}")
+            for kind, family in (("counter", self.counters), ("gauge", self.gauges)):
+                for name, samples in sorted(family.items()):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in sorted(samples.items()):
+                        lines.append(f"{name}{_format(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
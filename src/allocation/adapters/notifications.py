@@ -1,6 +1,7 @@
 # pylint: disable=too-few-public-methods
 import abc
 import smtplib
+import threading
 from allocation import config
 
 
@@ -16,13 +17,23 @@ DEFAULT_PORT = config.get_email_host_and_port()["port"]
 
 class EmailNotifications(AbstractNotifications):
     def __init__(self, smtp_host=DEFAULT_HOST, port=DEFAULT_PORT):
-        self.server = smtplib.SMTP(smtp_host, port=port)
-        self.server.noop()
+        self.smtp_host = smtp_host
+        self.port = port
+        # an SMTP connection handles one conversation at a time, and the async
+        # bus sends from its executor's threads, so each thread has its own
+        self._local = threading.local()
+        self._server().noop()
 
     def send(self, destination, message):
         msg = f"Subject: allocation service notification\n{message}"
-        self.server.sendmail(
+        self._server().sendmail(
             from_addr="allocations@example.com",
             to_addrs=[destination],
             msg=msg,
         )
+
+    def _server(self) -> smtplib.SMTP:
+        server = getattr(self._local, "server", None)
+        if server is None:
+            server = self._local.server = smtplib.SMTP(self.smtp_host, port=self.port)
+        return server
@@ -1,16 +1,23 @@
 import logging
+from typing import Optional
 from sqlalchemy import (
     Table,
     MetaData,
     Column,
     Integer,
     String,
+    Text,
     Date,
+    DateTime,
     ForeignKey,
+    Index,
+    UniqueConstraint,
     event,
+    func,
 )
 from sqlalchemy.orm import mapper, relationship
 
+from allocation import config
 from allocation.domain import model
 
 logger = logging.getLogger(__name__)
@@ -41,6 +48,9 @@ batches = Table(
     Column("sku", ForeignKey("products.sku")),
     Column("_purchased_quantity", Integer, nullable=False),
     Column("eta", Date, nullable=True),
+    # get_by_batchref, and loading a product's batches
+    Index("ix_batches_reference", "reference", unique=True),
+    Index("ix_batches_sku", "sku"),
 )
 
 allocations = Table(
@@ -49,6 +59,8 @@ allocations = Table(
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("orderline_id", ForeignKey("order_lines.id")),
     Column("batch_id", ForeignKey("batches.id")),
+    # also loads a batch's allocations, and deletes a deallocated line
+    UniqueConstraint("batch_id", "orderline_id", name="uq_allocations_batch_line"),
 )
 
 allocations_view = Table(
@@ -57,11 +69,68 @@ allocations_view = Table(
     Column("orderid", String(255)),
     Column("sku", String(255)),
     Column("batchref", String(255)),
+    # /allocations/<orderid>, and removing a deallocated line
+    Index("ix_allocations_view_orderid_sku", "orderid", "sku"),
 )
 
+stock_levels = Table(
+    "stock_levels",
+    metadata,
+    Column("sku", String(255), primary_key=True),
+    Column("available", Integer, nullable=False),
+)
+
+outbox = Table(
+    "outbox",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("channel", String(255), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False, server_default=func.now()),
+)
 
-def start_mappers():
-    logger.info("Starting mappers")
+projection_queue = Table(
+    "projection_queue",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("event_type", String(255), nullable=False),
+    Column("payload", Text, nullable=False),
+    # timestamptz, like now(), so projection lag can subtract one from the other
+    Column(
+        "created_at",
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+    ),
+)
+
+projector_checkpoints = Table(
+    "projector_checkpoints",
+    metadata,
+    Column("name", String(255), primary_key=True),
+    Column("position", Integer, nullable=False),
+    # the replica lag probe subtracts this from now(), so timestamptz too
+    Column(
+        "updated_at",
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+    ),
+)
+
+
+# how Product.batches and Batch._allocations are loaded: "lazy" issues a
+# query per collection on first access, "selectin" one query per level,
+# "joined" a single outer-joined query
+LOADING_STRATEGIES = {"lazy": "select", "selectin": "selectin", "joined": "joined"}
+
+
+def start_mappers(loading: Optional[str] = None):
+    loading = loading or config.get_orm_loading()
+    if loading not in LOADING_STRATEGIES:
+        raise ValueError(f"Unknown loading strategy {loading}")
+    logger.info("Starting mappers, loading=%s", loading)
+    lazy = LOADING_STRATEGIES[loading]
     lines_mapper = mapper(model.OrderLine, order_lines)
     batches_mapper = mapper(
         model.Batch,
@@ -71,16 +140,28 @@ def start_mappers():
                 lines_mapper,
                 secondary=allocations,
                 collection_class=set,
+                lazy=lazy,
             )
         },
     )
     mapper(
         model.Product,
         products,
-        properties={"batches": relationship(batches_mapper)},
+        properties={"batches": relationship(batches_mapper, lazy=lazy)},
+        # the domain bumps version_number on every change; updates check it
+        # with WHERE version_number = <as loaded> and fail if someone won
+        version_id_col=products.c.version_number,
+        version_id_generator=False,
     )
 
 
 @event.listens_for(model.Product, "load")
 def receive_load(product, _):
     product.events = []
+    product.reset_batch_index()
+
+
+@event.listens_for(model.Batch, "load")
+@event.listens_for(model.Batch, "refresh")
+def receive_batch_load(batch, *_):
+    batch.reset_allocated_quantity()
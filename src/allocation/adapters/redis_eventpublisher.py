@@ -1,16 +1,17 @@
-import json
 import logging
-from dataclasses import asdict
+from typing import Iterable, Tuple
 import redis
 
 from allocation import config
-from allocation.domain import events
 
 logger = logging.getLogger(__name__)
 
 r = redis.Redis(**config.get_redis_host_and_port())
 
 
-def publish(channel, event: events.Event):
-    logging.info("publishing: channel=%s, event=%s", channel, event)
-    r.publish(channel, json.dumps(asdict(event)))
+def publish_many(messages: Iterable[Tuple[str, str]]):
+    pipe = r.pipeline(transaction=False)
+    for channel, payload in messages:
+        logger.info("publishing: channel=%s, payload=%s", channel, payload)
+        pipe.publish(channel, payload)
+    pipe.execute()
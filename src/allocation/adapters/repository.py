@@ -1,8 +1,13 @@
 import abc
-from typing import Set
-from allocation.adapters import orm
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import select
+from allocation.adapters import memory_store, orm
 from allocation.domain import model
 
+CacheEntry = Tuple[model.Product, int]
+
 
 class AbstractRepository(abc.ABC):
     def __init__(self):
@@ -24,31 +29,126 @@ class AbstractRepository(abc.ABC):
             self.seen.add(product)
         return product
 
+    def add_many(self, products: Iterable[model.Product]):
+        products = list(products)
+        self._add_many(products)
+        self.seen.update(products)
+
+    def get_many(self, skus: Iterable[str]) -> List[model.Product]:
+        products = self._get_many(set(skus))
+        self.seen.update(products)
+        return products
+
+    def get_many_by_batchrefs(self, batchrefs: Iterable[str]) -> List[model.Product]:
+        products = self._get_many_by_batchrefs(set(batchrefs))
+        self.seen.update(products)
+        return products
+
     @abc.abstractmethod
     def _add(self, product: model.Product):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def _add_many(self, products: List[model.Product]):
+        raise NotImplementedError
+
     @abc.abstractmethod
     def _get(self, sku) -> model.Product:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def _get_many(self, skus: Set[str]) -> List[model.Product]:
+        raise NotImplementedError
+
     @abc.abstractmethod
     def _get_by_batchref(self, batchref) -> model.Product:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def _get_many_by_batchrefs(self, batchrefs: Set[str]) -> List[model.Product]:
+        raise NotImplementedError
+
+
+class ProductCache:
+    """Committed products kept between units of work, least recently used
+    first out once their total weight goes over max_weight.
+
+    A product belongs to one unit of work at a time: take() removes it from
+    the cache, and it only comes back through put() after a commit.
+    """
+
+    def __init__(self, max_weight: int):
+        self.max_weight = max_weight
+        self.weight = 0
+        self._entries = OrderedDict()  # type: OrderedDict[str, CacheEntry]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def take(self, sku: str) -> Optional[model.Product]:
+        with self._lock:
+            product, weight = self._entries.pop(sku, (None, 0))
+            self.weight -= weight
+        return product
+
+    def put(self, product: model.Product):
+        weight = weigh(product)
+        with self._lock:
+            _, replaced = self._entries.pop(product.sku, (None, 0))
+            self._entries[product.sku] = (product, weight)
+            self.weight += weight - replaced
+            while self.weight > self.max_weight:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.weight -= evicted
+
+
+def weigh(product: model.Product) -> int:
+    # one per product, batch and allocation; only what's already loaded is
+    # counted, so weighing never triggers a lazy load
+    batches = product.__dict__.get("batches", ())
+    allocations = sum(len(b.__dict__.get("_allocations", ())) for b in batches)
+    return 1 + len(batches) + allocations
+
 
 class SqlAlchemyRepository(AbstractRepository):
-    def __init__(self, session):
+    def __init__(self, session, cache: Optional[ProductCache] = None):
         super().__init__()
         self.session = session
+        self.cache = cache
 
     def _add(self, product):
         self.session.add(product)
 
+    def _add_many(self, products):
+        self.session.add_all(products)
+
     def _get(self, sku):
+        if self.cache is not None:
+            product = next(iter(self._get_cached(self.cache, {sku})), None)
+            if product:
+                return product
         return self.session.query(model.Product).filter_by(sku=sku).first()
 
+    def _get_many(self, skus):
+        products = []  # type: List[model.Product]
+        if self.cache is not None:
+            products = self._get_cached(self.cache, skus)
+            skus = skus - {product.sku for product in products}
+        if skus:
+            products += (
+                self.session.query(model.Product)
+                .filter(orm.products.c.sku.in_(skus))
+                .all()
+            )
+        return products
+
     def _get_by_batchref(self, batchref):
+        if self.cache is not None:
+            sku = self.session.execute(
+                select(orm.batches.c.sku).where(orm.batches.c.reference == batchref)
+            ).scalar()
+            return self._get(sku) if sku else None
         return (
             self.session.query(model.Product)
             .join(model.Batch)
@@ -57,3 +157,75 @@ class SqlAlchemyRepository(AbstractRepository):
             )
             .first()
         )
+
+    def _get_many_by_batchrefs(self, batchrefs):
+        skus = select(orm.batches.c.sku).where(orm.batches.c.reference.in_(batchrefs))
+        if self.cache is not None:
+            return self._get_many(set(self.session.execute(skus).scalars()))
+        return (
+            self.session.query(model.Product)
+            .filter(orm.products.c.sku.in_(skus.scalar_subquery()))
+            .all()
+        )
+
+    def _get_cached(self, cache: ProductCache, skus: Set[str]) -> List[model.Product]:
+        taken = [product for product in map(cache.take, skus) if product]
+        if not taken:
+            return []
+        # every change to a product bumps its version, so an unchanged
+        # version means the cached copy is still what's in the database
+        versions = dict(
+            self.session.execute(
+                select(orm.products.c.sku, orm.products.c.version_number).where(
+                    orm.products.c.sku.in_([product.sku for product in taken])
+                )
+            ).all()
+        )
+        fresh = [p for p in taken if versions.get(p.sku) == p.version_number]
+        self.session.add_all(fresh)
+        return fresh
+
+
+class InMemoryRepository(AbstractRepository):
+    def __init__(self, store: memory_store.ProductStore):
+        super().__init__()
+        self.store = store
+        self.products = {}  # type: Dict[str, model.Product]
+        # the version each product had in the store, None if it's new
+        self.loaded_versions = {}  # type: Dict[str, Optional[int]]
+
+    def _add(self, product):
+        self.products[product.sku] = product
+        self.loaded_versions[product.sku] = None
+
+    def _add_many(self, products):
+        for product in products:
+            self._add(product)
+
+    def _get(self, sku):
+        if sku not in self.products:
+            state = self.store.get(sku)
+            if state is None:
+                return None
+            self.products[sku] = memory_store.load_product(state)
+            self.loaded_versions[sku] = state["version_number"]
+        return self.products[sku]
+
+    def _get_many(self, skus):
+        return [p for p in map(self._get, skus) if p]
+
+    def _get_by_batchref(self, batchref):
+        sku = self.store.sku_for_batchref(batchref) or next(
+            (
+                product.sku
+                for product in self.products.values()
+                for batch in product.batches
+                if batch.reference == batchref
+            ),
+            None,
+        )
+        return self._get(sku) if sku else None
+
+    def _get_many_by_batchrefs(self, batchrefs):
+        products = filter(None, map(self._get_by_batchref, batchrefs))
+        return list({product.sku: product for product in products}.values())
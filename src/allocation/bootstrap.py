@@ -1,6 +1,9 @@
+import asyncio
+import functools
 import inspect
-from typing import Callable
-from allocation.adapters import orm, redis_eventpublisher
+from typing import Optional, Union
+from allocation.adapters import orm
+from allocation.adapters.metrics import AbstractMetrics, PrometheusMetrics
 from allocation.adapters.notifications import (
     AbstractNotifications,
     EmailNotifications,
@@ -10,34 +13,51 @@ from allocation.service_layer import handlers, messagebus, unit_of_work
 
 def bootstrap(
     start_orm: bool = True,
-    uow: unit_of_work.AbstractUnitOfWork = unit_of_work.SqlAlchemyUnitOfWork(),
+    uow: Optional[unit_of_work.AbstractUnitOfWork] = None,
+    read_uow: Optional[unit_of_work.ReadUnitOfWork] = None,
     notifications: AbstractNotifications = None,
-    publish: Callable = redis_eventpublisher.publish,
-) -> messagebus.MessageBus:
+    metrics: Optional[AbstractMetrics] = None,
+    asynchronous: bool = False,
+) -> Union[messagebus.MessageBus, messagebus.AsyncMessageBus]:
+
+    if uow is None:
+        uow = unit_of_work.default_unit_of_work()
+    if isinstance(uow, unit_of_work.InMemoryUnitOfWork):
+        # nothing would publish its events or project them into the views
+        raise ValueError("The in-memory store has no outbox or read model yet")
 
     if notifications is None:
         notifications = EmailNotifications()
 
+    if metrics is None:
+        metrics = PrometheusMetrics()
+    uow.metrics = metrics
+
+    if read_uow is None:
+        read_uow = unit_of_work.default_read_unit_of_work(uow)
+    read_uow.metrics = metrics
+
     if start_orm:
         orm.start_mappers()
 
-    dependencies = {"uow": uow, "notifications": notifications, "publish": publish}
+    dependencies = {"uow": uow, "notifications": notifications}
+    inject = inject_dependencies_async if asynchronous else inject_dependencies
     injected_event_handlers = {
-        event_type: [
-            inject_dependencies(handler, dependencies)
-            for handler in event_handlers
-        ]
+        event_type: [inject(handler, dependencies) for handler in event_handlers]
         for event_type, event_handlers in handlers.EVENT_HANDLERS.items()
     }
     injected_command_handlers = {
-        command_type: inject_dependencies(handler, dependencies)
+        command_type: inject(handler, dependencies)
         for command_type, handler in handlers.COMMAND_HANDLERS.items()
     }
 
-    return messagebus.MessageBus(
+    bus_class = messagebus.AsyncMessageBus if asynchronous else messagebus.MessageBus
+    return bus_class(
         uow=uow,
         event_handlers=injected_event_handlers,
         command_handlers=injected_command_handlers,
+        metrics=metrics,
+        read_uow=read_uow,
     )
 
 
@@ -48,4 +68,18 @@ def inject_dependencies(handler, dependencies):
         for name, dependency in dependencies.items()
         if name in params
     }
-    return lambda message: handler(message, **deps)
+    return functools.wraps(handler)(lambda message: handler(message, **deps))
+
+
+def inject_dependencies_async(handler, dependencies):
+    injected = inject_dependencies(handler, dependencies)
+    if inspect.iscoroutinefunction(handler):
+        return injected
+    if "uow" in inspect.signature(handler).parameters:
+        # anything touching the unit of work stays in order on the loop thread
+        return injected
+    return functools.wraps(handler)(
+        lambda message: asyncio.get_running_loop().run_in_executor(
+            None, injected, message
+        )
+    )
@@ -9,6 +9,29 @@ def get_postgres_uri():
     return f"postgresql://{user}:{password}@{host}:{port}/{db_name}"
 
 
+def get_replica_uri():
+    host = os.environ.get("DB_REPLICA_HOST")
+    if not host:
+        return None
+    password = os.environ.get("DB_PASSWORD", "abc123")
+    user, db_name = "allocation", "allocation"
+    return f"postgresql://{user}:{password}@{host}:5432/{db_name}"
+
+
+def get_replica_max_lag():
+    return float(os.environ.get("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+
+
+def get_pool_settings():
+    return dict(
+        pool_size=int(os.environ.get("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.environ.get("DB_POOL_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", "-1")),
+        pool_pre_ping=os.environ.get("DB_POOL_PRE_PING", "false").lower() == "true",
+    )
+
+
 def get_api_url():
     host = os.environ.get("API_HOST", "localhost")
     port = 5005 if host == "localhost" else 80
@@ -26,3 +49,23 @@ def get_email_host_and_port():
     port = 11025 if host == "localhost" else 1025
     http_port = 18025 if host == "localhost" else 8025
     return dict(host=host, port=port, http_port=http_port)
+
+
+def get_coalescing_window():
+    return float(os.environ.get("COALESCING_WINDOW_SECONDS", "0.05"))
+
+
+def get_product_cache_weight():
+    return int(os.environ.get("PRODUCT_CACHE_WEIGHT", "0"))
+
+
+def get_orm_loading():
+    return os.environ.get("ORM_LOADING", "selectin")
+
+
+def get_memory_store_path():
+    return os.environ.get("MEMORY_STORE_PATH")
+
+
+def get_allocations_cache():
+    return os.environ.get("ALLOCATIONS_CACHE", "none")
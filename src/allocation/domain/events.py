@@ -1,11 +1,29 @@
 # pylint: disable=too-few-public-methods
 from dataclasses import dataclass
+from .slots import slotted
 
 
 class Event:
-    pass
+    __slots__ = ()
 
 
+@slotted
+@dataclass
+class BatchCreated(Event):
+    ref: str
+    sku: str
+    qty: int
+
+
+@slotted
+@dataclass
+class BatchQuantityChanged(Event):
+    ref: str
+    sku: str
+    delta: int
+
+
+@slotted
 @dataclass
 class Allocated(Event):
     orderid: str
@@ -14,6 +32,7 @@ class Allocated(Event):
     batchref: str
 
 
+@slotted
 @dataclass
 class Deallocated(Event):
     orderid: str
@@ -21,6 +40,7 @@ class Deallocated(Event):
     qty: int
 
 
+@slotted
 @dataclass
 class OutOfStock(Event):
     sku: str
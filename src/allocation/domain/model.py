@@ -1,9 +1,19 @@
 from __future__ import annotations
+from bisect import bisect_left, insort
 from dataclasses import dataclass
 from datetime import date
-from typing import Optional, List, Set
+from typing import Optional, List, Set, Dict, Iterator, Tuple
+import numpy as np
 from . import commands, events
 
+# (is_shipment, eta, position in self.batches, batch): warehouse stock sorts
+# first, then earliest eta, with ties kept in insertion order like sorted()
+IndexEntry = Tuple[bool, date, int, "Batch"]
+
+
+class UnknownBatch(Exception):
+    pass
+
 
 class Product:
     def __init__(self, sku: str, batches: List[Batch], version_number: int = 0):
@@ -11,11 +21,39 @@ class Product:
         self.batches = batches
         self.version_number = version_number
         self.events = []  # type: List[events.Event]
+        self.reset_batch_index()
+
+    def reset_batch_index(self):
+        self._indexed = 0
+        self._batches_by_ref = {}  # type: Dict[str, Batch]
+        self._index_entries = {}  # type: Dict[Batch, IndexEntry]
+        self._allocatable = []  # type: List[IndexEntry]
+
+    def add_batch(self, batch: Batch):
+        self.batches.append(batch)
+        self._index_new_batches()
+        self.version_number += 1
+        self.events.append(
+            events.BatchCreated(batch.reference, batch.sku, batch._purchased_quantity)
+        )
+
+    def get_batch(self, ref: str) -> Batch:
+        self._index_new_batches()
+        try:
+            return self._batches_by_ref[ref]
+        except KeyError:
+            raise UnknownBatch(f"Unknown batch {ref}") from None
 
     def allocate(self, line: OrderLine) -> str:
+        # a line the product already holds stays where it is, with no event:
+        # the projector would otherwise count its qty twice
+        holder = next((b for b in self.batches if line in b._allocations), None)
+        if holder is not None:
+            return holder.reference
         try:
-            batch = next(b for b in sorted(self.batches) if b.can_allocate(line))
+            batch = next(b for b in self._batches_by_eta() if b.can_allocate(line))
             batch.allocate(line)
+            self._update_batch_index(batch)
             self.version_number += 1
             self.events.append(
                 events.Allocated(
@@ -30,12 +68,108 @@ class Product:
             self.events.append(events.OutOfStock(line.sku))
             return None
 
+    def allocate_many(self, lines: List[OrderLine]) -> List[Optional[str]]:
+        qtys = np.array([line.qty for line in lines], dtype=np.int64)
+        first_copy = {}  # type: Dict[OrderLine, int]
+        for i, line in enumerate(lines):
+            first_copy.setdefault(line, i)
+        held = {
+            line: batch.reference
+            for batch in self.batches
+            for line in batch._allocations & first_copy.keys()
+        }
+        # as with allocate, only the first copy of a line not yet held is
+        # placed; every other copy ends up wherever that one went
+        pending = np.array(
+            [
+                i
+                for line, i in first_copy.items()
+                if line.sku == self.sku and line not in held
+            ],
+            dtype=np.intp,
+        )
+        placed = np.zeros(len(lines), dtype=bool)
+        batchrefs = [None] * len(lines)  # type: List[Optional[str]]
+        for batch in list(self._batches_by_eta()):
+            if not pending.size:
+                break
+            taken = _first_fit(qtys, pending, batch.available_quantity)
+            for i in taken:
+                batch.allocate(lines[i])
+                batchrefs[i] = batch.reference
+            placed[taken] = True
+            pending = pending[~placed[pending]]
+            self._update_batch_index(batch)
+
+        for i, line in enumerate(lines):
+            if line in held:
+                batchrefs[i] = held[line]
+                continue
+            batchref = batchrefs[i] = batchrefs[first_copy[line]]
+            if batchref is None:
+                self.events.append(events.OutOfStock(line.sku))
+            elif first_copy[line] == i:
+                self.version_number += 1
+                self.events.append(
+                    events.Allocated(line.orderid, line.sku, line.qty, batchref)
+                )
+        return batchrefs
+
     def change_batch_quantity(self, ref: str, qty: int):
-        batch = next(b for b in self.batches if b.reference == ref)
-        batch._purchased_quantity = qty
-        while batch.available_quantity < 0:
-            line = batch.deallocate_one()
+        batch = self.get_batch(ref)
+        delta, batch._purchased_quantity = qty - batch._purchased_quantity, qty
+        self.events.append(events.BatchQuantityChanged(ref, self.sku, delta))
+        deallocated = batch.deallocate_excess()
+        self._update_batch_index(batch)
+        self.version_number += 1
+        for line in deallocated:
             self.events.append(events.Deallocated(line.orderid, line.sku, line.qty))
+            self.allocate(line)
+
+    def _batches_by_eta(self) -> Iterator[Batch]:
+        self._index_new_batches()
+        for *_, batch in self._allocatable:
+            if batch.available_quantity > 0:
+                yield batch
+
+    def _index_new_batches(self):
+        for position in range(self._indexed, len(self.batches)):
+            batch = self.batches[position]
+            entry = (batch.eta is not None, batch.eta or date.min, position, batch)
+            self._batches_by_ref[batch.reference] = batch
+            self._index_entries[batch] = entry
+            if batch.available_quantity > 0:
+                insort(self._allocatable, entry)
+        self._indexed = len(self.batches)
+
+    def _update_batch_index(self, batch: Batch):
+        self._index_new_batches()
+        entry = self._index_entries[batch]
+        i = bisect_left(self._allocatable, entry)
+        indexed = i < len(self._allocatable) and self._allocatable[i] is entry
+        if batch.available_quantity > 0 and not indexed:
+            self._allocatable.insert(i, entry)
+        elif batch.available_quantity <= 0 and indexed:
+            del self._allocatable[i]
+
+
+def _first_fit(qtys: np.ndarray, pending: np.ndarray, capacity: int) -> np.ndarray:
+    """Indices from pending (in order) that sequential allocation would place
+    in a batch with this much room: each line goes in if its qty still fits."""
+    taken = []
+    while pending.size and capacity > 0:
+        # capacity only shrinks, so lines bigger than it now never fit later
+        pending = pending[qtys[pending] <= capacity]
+        if not pending.size:
+            break
+        running = np.cumsum(qtys[pending])
+        # the run stops at the first line that overflows what is left; it
+        # can't fit once anything else has gone in
+        fits = int(np.searchsorted(running, capacity, side="right"))
+        taken.append(pending[:fits])
+        capacity -= int(running[fits - 1])
+        pending = pending[fits:]
+    return np.concatenate(taken) if taken else pending[:0]
 
 
 @dataclass(unsafe_hash=True)
@@ -52,6 +186,7 @@ class Batch:
         self.eta = eta
         self._purchased_quantity = qty
         self._allocations = set()  # type: Set[OrderLine]
+        self._allocated_quantity = 0  # type: Optional[int]
 
     def __repr__(self):
         return f"<Batch {self.reference}>"
@@ -72,15 +207,57 @@ class Batch:
         return self.eta > other.eta
 
     def allocate(self, line: OrderLine):
-        if self.can_allocate(line):
+        if self.can_allocate(line) and line not in self._allocations:
+            self._allocated_quantity = self.allocated_quantity + line.qty
             self._allocations.add(line)
 
-    def deallocate_one(self) -> OrderLine:
-        return self._allocations.pop()
+    def deallocate(self, line: OrderLine):
+        if line in self._allocations:
+            self._allocated_quantity = self.allocated_quantity - line.qty
+            self._allocations.remove(line)
+
+    def deallocate_excess(self) -> List[OrderLine]:
+        """Deallocate the fewest lines that bring available_quantity back to
+        zero or above, picking the smallest that will do at each step"""
+        excess = -self.available_quantity
+        if excess <= 0:
+            return []
+        remaining = sorted(self._allocations, key=lambda l: (l.qty, l.orderid))
+        count, freed = 0, 0
+        for line in reversed(remaining):
+            if freed >= excess:
+                break
+            count, freed = count + 1, freed + line.qty
+        deallocated = []
+        for left in reversed(range(count)):
+            # whichever line is picked, the `left` largest of the others have
+            # to be able to make up the rest of the excess
+            n = len(remaining)
+            top = sum(l.qty for l in remaining[n - left :])
+            others = [top] * (n - left) + [
+                top + remaining[n - left - 1].qty - l.qty
+                for l in remaining[n - left :]
+            ]
+            i = next(
+                i
+                for i, line in enumerate(remaining)
+                if line.qty + others[i] >= excess
+            )
+            line = remaining.pop(i)
+            deallocated.append(line)
+            excess -= line.qty
+        for line in deallocated:
+            self.deallocate(line)
+        return deallocated
+
+    def reset_allocated_quantity(self):
+        self._allocated_quantity = None
 
     @property
     def allocated_quantity(self) -> int:
-        return sum(line.qty for line in self._allocations)
+        if self._allocated_quantity is None:
+            self._allocated_quantity = sum(line.qty for line in self._allocations)
+        return self._allocated_quantity
 
     @property
     def available_quantity(self) -> int:
@@ -0,0 +1,12 @@
+from dataclasses import fields
+
+
+def slotted(cls):
+    """Rebuild a dataclass with __slots__ for its fields (what Python 3.10's
+    dataclass(slots=True) does, usable with field defaults on 3.8 and 3.9)"""
+    names = tuple(f.name for f in fields(cls))
+    namespace = {k: v for k, v in cls.__dict__.items() if k not in names}
+    namespace.pop("__dict__", None)
+    namespace.pop("__weakref__", None)
+    namespace["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
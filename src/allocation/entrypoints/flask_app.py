@@ -1,11 +1,21 @@
+import csv
+import io
+import json
 from datetime import datetime
-from flask import Flask, jsonify, request
+from typing import List, Optional
+from flask import Flask, Response, jsonify, request
 from allocation.domain import commands
 from allocation.service_layer.handlers import InvalidSku
 from allocation import bootstrap, views
+from allocation.adapters.allocations_cache import default_allocations_cache
 
 app = Flask(__name__)
 bus = bootstrap.bootstrap()
+allocations_cache = default_allocations_cache()
+allocations_cache.metrics = bus.metrics
+
+MAX_BULK_ORDERIDS = 10_000
+EXPORT_COLUMNS = ["orderid", "sku", "batchref"]
 
 
 @app.route("/add_batch", methods=["POST"])
@@ -35,7 +45,70 @@ def allocate_endpoint():
 
 @app.route("/allocations/<orderid>", methods=["GET"])
 def allocations_view_endpoint(orderid):
-    result = views.allocations(orderid, bus.uow)
+    result = views.allocations(orderid, bus.read_uow, allocations_cache)
     if not result:
         return "not found", 404
     return jsonify(result), 200
+
+
+@app.route("/allocations", methods=["POST"])
+def bulk_allocations_view_endpoint():
+    orderids = _orderids(request.json)
+    if orderids is None:
+        return {"message": "orderids must be a list of strings"}, 400
+    if len(orderids) > MAX_BULK_ORDERIDS:
+        return {"message": f"At most {MAX_BULK_ORDERIDS} orderids per request"}, 400
+    result = views.allocations_for_orders(orderids, bus.read_uow, allocations_cache)
+    return jsonify(result), 200
+
+
+@app.route("/stock/<sku>", methods=["GET"])
+def stock_view_endpoint(sku):
+    available = views.stock(sku, bus.read_uow)
+    if available is None:
+        return "not found", 404
+    return jsonify({"sku": sku, "available": available}), 200
+
+
+@app.route("/export/allocations", methods=["GET"])
+def export_allocations_endpoint():
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv"):
+        return {"message": f"Unknown format {export_format}"}, 400
+    chunks = views.export_allocations(bus.read_uow)
+    if export_format == "csv":
+        return Response(_csv_lines(chunks), mimetype="text/csv")
+    return Response(_ndjson_lines(chunks), mimetype="application/x-ndjson")
+
+
+def _orderids(payload) -> Optional[List[str]]:
+    orderids = payload.get("orderids") if isinstance(payload, dict) else None
+    if not isinstance(orderids, list):
+        return None
+    if not all(isinstance(orderid, str) for orderid in orderids):
+        return None
+    return orderids
+
+
+def _ndjson_lines(chunks):
+    for rows in chunks:
+        yield "".join(json.dumps(row) + "\n" for row in rows)
+
+
+def _csv_lines(chunks):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_COLUMNS)
+    writer.writeheader()
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    lag = views.projection_lag(bus.read_uow)
+    bus.metrics.gauge("projector_lag_seconds", lag)
+    return bus.metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
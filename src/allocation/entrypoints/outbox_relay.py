@@ -0,0 +1,50 @@
+import logging
+import time
+from typing import Callable
+
+from allocation.adapters import orm, redis_eventpublisher
+from allocation.service_layer import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+POLL_INTERVAL = 0.1
+
+
+def main():
+    logger.info("Outbox relay starting")
+    while True:
+        if not relay(unit_of_work.default_session_factory()):
+            time.sleep(POLL_INTERVAL)
+
+
+def relay(
+    session_factory,
+    publish_many: Callable = redis_eventpublisher.publish_many,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    # rows are only deleted once redis has taken them, so delivery is
+    # at-least-once: a crash between publish and commit republishes the batch
+    session = session_factory()
+    try:
+        rows = session.execute(
+            orm.outbox.select()
+            .order_by(orm.outbox.c.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).fetchall()
+        if rows:
+            publish_many([(row.channel, row.payload) for row in rows])
+            session.execute(
+                orm.outbox.delete().where(
+                    orm.outbox.c.id.in_([row.id for row in rows])
+                )
+            )
+        session.commit()
+        return len(rows)
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from sqlalchemy import bindparam, func, select, tuple_
+
+from allocation.adapters import orm
+from allocation.adapters.allocations_cache import (
+    AbstractAllocationsCache,
+    NullAllocationsCache,
+    default_allocations_cache,
+)
+from allocation.service_layer import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+NAME = "read_model"
+BATCH_SIZE = 1000
+POLL_INTERVAL = 0.1
+
+Projected = List[Tuple[str, dict]]
+
+# how each event moves a sku's available stock
+STOCK_CHANGES = {
+    "BatchCreated": lambda event: event["qty"],
+    "BatchQuantityChanged": lambda event: event["delta"],
+    "Allocated": lambda event: -event["qty"],
+    "Deallocated": lambda event: event["qty"],
+}  # type: Dict[str, Callable[[dict], int]]
+
+
+def main():
+    logger.info("Projector starting")
+    session_factory = unit_of_work.default_session_factory()
+    allocations_cache = default_allocations_cache()
+    while True:
+        if not project(session_factory, allocations_cache):
+            time.sleep(POLL_INTERVAL)
+
+
+def project(
+    session_factory,
+    allocations_cache: Optional[AbstractAllocationsCache] = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    # the batch is applied, dequeued and checkpointed in one transaction, so
+    # each event is applied exactly once, and holding the checkpoint row
+    # keeps a second projector from applying batches out of order
+    allocations_cache = allocations_cache or NullAllocationsCache()
+    session = session_factory()
+    try:
+        _lock_checkpoint(session)
+        rows = session.execute(
+            orm.projection_queue.select()
+            .order_by(orm.projection_queue.c.id)
+            .limit(batch_size)
+        ).fetchall()
+        orderids = set()  # type: Set[str]
+        if rows:
+            projected = [(row.event_type, json.loads(row.payload)) for row in rows]
+            orderids = apply_allocations(session, projected)
+            apply_stock_levels(session, projected)
+            session.execute(
+                orm.projection_queue.delete().where(
+                    orm.projection_queue.c.id.in_([row.id for row in rows])
+                )
+            )
+        # stamped on every poll, so replicas can tell how far behind they are
+        checkpoint = dict(position=rows[-1].id) if rows else {}
+        session.execute(
+            orm.projector_checkpoints.update()
+            .where(orm.projector_checkpoints.c.name == NAME)
+            .values(updated_at=func.now(), **checkpoint)
+        )
+        session.commit()
+    finally:
+        session.close()
+    for orderid in orderids:
+        allocations_cache.invalidate(orderid)
+    return len(rows)
+
+
+def apply_allocations(session, projected: Projected) -> Set[str]:
+    # net each (orderid, sku) out first: a Deallocated removes every row
+    # before it, so one DELETE covers the batch and earlier inserts never run
+    deleted = set()  # type: Set[Tuple[str, str]]
+    inserted = {}  # type: Dict[Tuple[str, str], List[str]]
+    for event_type, event in projected:
+        if event_type == "Deallocated":
+            key = (event["orderid"], event["sku"])
+            deleted.add(key)
+            inserted.pop(key, None)
+        elif event_type == "Allocated":
+            key = (event["orderid"], event["sku"])
+            inserted.setdefault(key, []).append(event["batchref"])
+    view = orm.allocations_view
+    if deleted:
+        # the orderid prefilter is what lets the (orderid, sku) index be used
+        session.execute(
+            view.delete().where(
+                view.c.orderid.in_({orderid for orderid, _ in deleted}),
+                tuple_(view.c.orderid, view.c.sku).in_(deleted),
+            )
+        )
+    if inserted:
+        session.execute(
+            view.insert(),
+            [
+                dict(orderid=orderid, sku=sku, batchref=batchref)
+                for (orderid, sku), batchrefs in inserted.items()
+                for batchref in batchrefs
+            ],
+        )
+    return {orderid for orderid, _ in deleted | inserted.keys()}
+
+
+def apply_stock_levels(session, projected: Projected):
+    # one net change per sku, applied as an increment so the projector never
+    # has to read the product's batches
+    deltas = defaultdict(int)  # type: Dict[str, int]
+    for event_type, event in projected:
+        if event_type in STOCK_CHANGES:
+            deltas[event["sku"]] += STOCK_CHANGES[event_type](event)
+    if not deltas:
+        return
+    levels = orm.stock_levels
+    existing = set(
+        session.execute(
+            select(levels.c.sku).where(levels.c.sku.in_(deltas))
+        ).scalars()
+    )
+    if existing:
+        session.execute(
+            levels.update()
+            .where(levels.c.sku == bindparam("level_sku"))
+            .values(available=levels.c.available + bindparam("delta")),
+            [dict(level_sku=sku, delta=deltas[sku]) for sku in existing],
+        )
+    if len(existing) < len(deltas):
+        session.execute(
+            levels.insert(),
+            [
+                dict(sku=sku, available=delta)
+                for sku, delta in deltas.items()
+                if sku not in existing
+            ],
+        )
+
+
+def _lock_checkpoint(session):
+    position = session.execute(
+        select(orm.projector_checkpoints.c.position)
+        .where(orm.projector_checkpoints.c.name == NAME)
+        .with_for_update()
+    ).scalar()
+    if position is None:
+        session.execute(
+            orm.projector_checkpoints.insert().values(name=NAME, position=0)
+        )
+
+
+if __name__ == "__main__":
+    main()
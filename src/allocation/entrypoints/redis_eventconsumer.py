@@ -4,6 +4,7 @@ import redis
 
 from allocation import bootstrap, config
 from allocation.domain import commands
+from allocation.service_layer import coalescing, messagebus
 
 logger = logging.getLogger(__name__)
 
@@ -13,18 +14,26 @@ r = redis.Redis(**config.get_redis_host_and_port())
 def main():
     logger.info("Redis pubsub starting")
     bus = bootstrap.bootstrap()
+    assert isinstance(bus, messagebus.MessageBus)
     pubsub = r.pubsub(ignore_subscribe_messages=True)
     pubsub.subscribe("change_batch_quantity")
+    coalescer = coalescing.CommandCoalescer(bus)
 
-    for m in pubsub.listen():
-        handle_change_batch_quantity(m, bus)
+    while True:
+        time_left = coalescer.time_left()
+        m = pubsub.get_message(timeout=1.0 if time_left is None else time_left)
+        if m is not None:
+            handle_change_batch_quantity(m, coalescer)
+        if coalescer.due():
+            for cmd, e in coalescer.flush():
+                logger.error("failed to handle %s: %s", cmd, e)
 
 
-def handle_change_batch_quantity(m, bus):
+def handle_change_batch_quantity(m, coalescer):
     logger.info("handling %s", m)
     data = json.loads(m["data"])
     cmd = commands.ChangeBatchQuantity(ref=data["batchref"], qty=data["qty"])
-    bus.handle(cmd)
+    coalescer.submit(cmd)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import itertools
+import logging
+import time
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Protocol,
+    Tuple,
+    TYPE_CHECKING,
+)
+from allocation import config
+from allocation.domain import commands
+
+if TYPE_CHECKING:
+    from . import messagebus
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING = 100
+
+
+class Counter(Protocol):
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None: ...
+
+
+class GroupHandler(Protocol):
+    """The part of the bus the coalescer uses."""
+
+    @property
+    def metrics(self) -> Counter: ...
+
+    def handle_group(
+        self, messages: Iterable[messagebus.Message]
+    ) -> List[Tuple[messagebus.Message, Exception]]: ...
+
+
+class CommandCoalescer:
+    """Holds commands for up to `window` seconds before handing them to the bus.
+
+    A ChangeBatchQuantity replaces any pending one for the same batch ref, and
+    everything flushed together is handled in one group commit, so a burst of
+    commands costs one transaction instead of one each.
+    """
+
+    def __init__(
+        self,
+        bus: GroupHandler,
+        window: Optional[float] = None,
+        max_pending: int = MAX_PENDING,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.bus = bus
+        self.window = config.get_coalescing_window() if window is None else window
+        self.max_pending = max_pending
+        self.clock = clock
+        self.elided = 0
+        self._pending = {}  # type: Dict[Hashable, commands.Command]
+        self._sequence = itertools.count()
+        self._opened_at = None  # type: Optional[float]
+
+    def submit(self, cmd: commands.Command):
+        if self._opened_at is None:
+            self._opened_at = self.clock()
+        if isinstance(cmd, commands.ChangeBatchQuantity):
+            key = ("ChangeBatchQuantity", cmd.ref)  # type: Hashable
+            if self._pending.pop(key, None) is not None:
+                self.elided += 1
+                self.bus.metrics.increment(
+                    "commands_coalesced_total", message_type=type(cmd).__name__
+                )
+        else:
+            key = next(self._sequence)
+        self._pending[key] = cmd
+
+    def time_left(self) -> Optional[float]:
+        if self._opened_at is None:
+            return None
+        return max(0.0, self._opened_at + self.window - self.clock())
+
+    def due(self) -> bool:
+        if len(self._pending) >= self.max_pending:
+            return True
+        return self.time_left() == 0.0
+
+    def flush(self) -> List[Tuple[messagebus.Message, Exception]]:
+        cmds = list(self._pending.values())
+        self._pending.clear()
+        self._opened_at = None
+        if not cmds:
+            return []
+        logger.info("handling %d commands, %d elided so far", len(cmds), self.elided)
+        return self.bus.handle_group(cmds)
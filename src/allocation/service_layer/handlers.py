@@ -1,6 +1,6 @@
 # pylint: disable=unused-argument
 from __future__ import annotations
-from dataclasses import asdict
+from collections import defaultdict
 from typing import List, Dict, Callable, Type, TYPE_CHECKING
 from allocation.domain import commands, events, model
 from allocation.domain.model import OrderLine
@@ -23,7 +23,7 @@ def add_batch(
         if product is None:
             product = model.Product(cmd.sku, batches=[])
             uow.products.add(product)
-        product.batches.append(model.Batch(cmd.ref, cmd.sku, cmd.qty, cmd.eta))
+        product.add_batch(model.Batch(cmd.ref, cmd.sku, cmd.qty, cmd.eta))
         uow.commit()
 
 
@@ -40,11 +40,21 @@ def allocate(
         uow.commit()
 
 
-def reallocate(
-    event: events.Deallocated,
+def allocate_many(
+    cmd: commands.AllocateMany,
     uow: unit_of_work.AbstractUnitOfWork,
 ):
-    allocate(commands.Allocate(**asdict(event)), uow=uow)
+    lines_by_sku = defaultdict(list)  # type: Dict[str, List[OrderLine]]
+    for c in cmd.lines:
+        lines_by_sku[c.sku].append(OrderLine(c.orderid, c.sku, c.qty))
+    with uow:
+        products = {p.sku: p for p in uow.products.get_many(lines_by_sku)}
+        for sku in lines_by_sku:
+            if sku not in products:
+                raise InvalidSku(f"Invalid sku {sku}")
+        for sku, lines in lines_by_sku.items():
+            products[sku].allocate_many(lines)
+        uow.commit()
 
 
 def change_batch_quantity(
@@ -53,6 +63,8 @@ def change_batch_quantity(
 ):
     with uow:
         product = uow.products.get_by_batchref(batchref=cmd.ref)
+        if product is None:
+            raise model.UnknownBatch(f"Unknown batch {cmd.ref}")
         product.change_batch_quantity(ref=cmd.ref, qty=cmd.qty)
         uow.commit()
 
@@ -70,51 +82,17 @@ def send_out_of_stock_notification(
     )
 
 
-def publish_allocated_event(
-    event: events.Allocated,
-    publish: Callable,
-):
-    publish("line_allocated", event)
-
-
-def add_allocation_to_read_model(
-    event: events.Allocated,
-    uow: unit_of_work.SqlAlchemyUnitOfWork,
-):
-    with uow:
-        uow.session.execute(
-            """
-            INSERT INTO allocations_view (orderid, sku, batchref)
-            VALUES (:orderid, :sku, :batchref)
-            """,
-            dict(orderid=event.orderid, sku=event.sku, batchref=event.batchref),
-        )
-        uow.commit()
-
-
-def remove_allocation_from_read_model(
-    event: events.Deallocated,
-    uow: unit_of_work.SqlAlchemyUnitOfWork,
-):
-    with uow:
-        uow.session.execute(
-            """
-            DELETE FROM allocations_view
-            WHERE orderid = :orderid AND sku = :sku
-            """,
-            dict(orderid=event.orderid, sku=event.sku),
-        )
-        uow.commit()
-
-
 EVENT_HANDLERS = {
-    events.Allocated: [publish_allocated_event, add_allocation_to_read_model],
-    events.Deallocated: [remove_allocation_from_read_model, reallocate],
+    events.BatchCreated: [],
+    events.BatchQuantityChanged: [],
+    events.Allocated: [],
+    events.Deallocated: [],
     events.OutOfStock: [send_out_of_stock_notification],
 }  # type: Dict[Type[events.Event], List[Callable]]
 
 COMMAND_HANDLERS = {
     commands.Allocate: allocate,
+    commands.AllocateMany: allocate_many,
     commands.CreateBatch: add_batch,
     commands.ChangeBatchQuantity: change_batch_quantity,
 }  # type: Dict[Type[commands.Command], Callable]
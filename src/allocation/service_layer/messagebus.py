@@ -1,55 +1,304 @@
 # pylint: disable=broad-except, attribute-defined-outside-init
 from __future__ import annotations
+import asyncio
+import inspect
+import itertools
 import logging
-from typing import Callable, Dict, List, Union, Type, TYPE_CHECKING
+import random
+import time
+from collections import deque
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    Type,
+)
+from allocation.adapters.metrics import AbstractMetrics, NullMetrics
 from allocation.domain import commands, events
-
-if TYPE_CHECKING:
-    from . import unit_of_work
+from . import unit_of_work
 
 logger = logging.getLogger(__name__)
 
 Message = Union[commands.Command, events.Event]
 
+RETRY_ATTEMPTS = 8
+RETRY_BACKOFF = 0.02
+
 
-class MessageBus:
+class BaseMessageBus:
     def __init__(
         self,
         uow: unit_of_work.AbstractUnitOfWork,
         event_handlers: Dict[Type[events.Event], List[Callable]],
         command_handlers: Dict[Type[commands.Command], Callable],
+        metrics: Optional[AbstractMetrics] = None,
+        read_uow: Optional[unit_of_work.ReadUnitOfWork] = None,
+        retry_attempts: int = RETRY_ATTEMPTS,
+        retry_backoff: float = RETRY_BACKOFF,
     ):
         self.uow = uow
         self.event_handlers = event_handlers
         self.command_handlers = command_handlers
+        self.metrics = metrics or NullMetrics()
+        self.read_uow = read_uow or unit_of_work.ReadUnitOfWork()
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+
+    def _retry_delay(self, command: commands.Command, attempt: int) -> float:
+        # exponential backoff with full jitter, so that commands that clashed
+        # once don't clash again in lockstep
+        logger.info("concurrent update handling %s, retrying", command)
+        self.metrics.increment(
+            "messagebus_command_retries_total", message_type=type(command).__name__
+        )
+        return random.uniform(0, self.retry_backoff * 2 ** (attempt - 1))
+
+    def _observe_handler(
+        self, message: Message, handler: Optional[Callable], started: float
+    ):
+        self.metrics.observe(
+            "messagebus_handler_seconds",
+            time.perf_counter() - started,
+            message_type=type(message).__name__,
+            handler=handler_name(handler),
+        )
+
+    def _count_exception(self, message: Message, handler: Optional[Callable]):
+        self.metrics.increment(
+            "messagebus_handler_exceptions_total",
+            message_type=type(message).__name__,
+            handler=handler_name(handler),
+        )
+
+    def _observe_message(self, message: Message, started: float):
+        self.metrics.observe(
+            "messagebus_message_seconds",
+            time.perf_counter() - started,
+            message_type=type(message).__name__,
+        )
+
+    def _observe_queue_depth(self, message: Message, peak: int):
+        self.metrics.observe(
+            "messagebus_queue_depth_peak", peak, message_type=type(message).__name__
+        )
+
+
+class MessageBus(BaseMessageBus):
+    # events held back until the group they were raised in has committed
+    _deferred = None  # type: Optional[List[Message]]
 
     def handle(self, message: Message):
-        self.queue = [message]
-        while self.queue:
-            message = self.queue.pop(0)
-            if isinstance(message, events.Event):
-                self.handle_event(message)
-            elif isinstance(message, commands.Command):
-                self.handle_command(message)
-            else:
-                raise Exception(f"{message} was not an Event or Command")
+        self.queue = deque([message])
+        self._process_queue()
+
+    def handle_many(
+        self, messages: Iterable[Message]
+    ) -> List[Tuple[Message, Exception]]:
+        # each message's cascade runs to completion before the next message;
+        # failures don't stop the batch and are returned to the caller
+        failures = []
+        self.queue = deque()
+        for message in messages:
+            self.queue.append(message)
+            try:
+                self._process_queue()
+            except Exception as e:
+                self.queue.clear()
+                failures.append((message, e))
+        return failures
+
+    def handle_group(
+        self, messages: Iterable[Message]
+    ) -> List[Tuple[Message, Exception]]:
+        # like handle_many, but inside one group commit: if that fails,
+        # nothing from the group was persisted and every message has failed.
+        # The events they raise are only handled once the group has committed,
+        # so no handler acts on work that then gets rolled back
+        messages = list(messages)
+        deferred = self._deferred = []
+        try:
+            with self.uow.group_commit():
+                failures = self.handle_many(messages)
+        except Exception as e:
+            logger.exception("Exception committing group of %d", len(messages))
+            return [(message, e) for message in messages]
+        finally:
+            self._deferred = None
+        self.handle_many(deferred)
+        return failures
+
+    def _collect_new_events(self):
+        new_events = self.uow.collect_new_events()
+        if self._deferred is None:
+            self.queue.extend(new_events)
+        else:
+            self._deferred.extend(new_events)
+
+    def _process_queue(self):
+        top_level, peak = self.queue[0], 0
+        try:
+            while self.queue:
+                peak = max(peak, len(self.queue))
+                message = self.queue.popleft()
+                started = time.perf_counter()
+                try:
+                    if isinstance(message, events.Event):
+                        self.handle_event(message)
+                    elif isinstance(message, commands.Command):
+                        self.handle_command(message)
+                    else:
+                        raise Exception(f"{message} was not an Event or Command")
+                finally:
+                    self._observe_message(message, started)
+        finally:
+            self._observe_queue_depth(top_level, peak)
 
     def handle_event(self, event: events.Event):
         for handler in self.event_handlers[type(event)]:
+            started = time.perf_counter()
             try:
                 logger.debug("handling event %s with handler %s", event, handler)
                 handler(event)
-                self.queue.extend(self.uow.collect_new_events())
+                self._collect_new_events()
             except Exception:
                 logger.exception("Exception handling event %s", event)
+                self._count_exception(event, handler)
                 continue
+            finally:
+                self._observe_handler(event, handler, started)
 
     def handle_command(self, command: commands.Command):
         logger.debug("handling command %s", command)
+        handler = None
+        started = time.perf_counter()
         try:
             handler = self.command_handlers[type(command)]
-            handler(command)
+            for attempt in itertools.count(1):
+                try:
+                    handler(command)
+                    break
+                except unit_of_work.ConcurrencyError:
+                    if attempt >= self.retry_attempts:
+                        raise
+                    time.sleep(self._retry_delay(command, attempt))
+            self._collect_new_events()
+        except Exception:
+            logger.exception("Exception handling command %s", command)
+            self._count_exception(command, handler)
+            raise
+        finally:
+            self._observe_handler(command, handler, started)
+
+
+class AsyncMessageBus(BaseMessageBus):
+    """Same semantics as MessageBus, but event handlers may return awaitables
+    (coroutines, or executor futures for blocking I/O).  Those run concurrently
+    with the rest of the cascade and are awaited before handle() returns."""
+
+    async def handle(self, message: Message):
+        self.queue = deque([message])
+        self.pending = []  # type: List[Awaitable]
+        await self._process_queue()
+
+    async def handle_many(
+        self, messages: Iterable[Message]
+    ) -> List[Tuple[Message, Exception]]:
+        failures = []
+        self.queue = deque()
+        self.pending = []
+        for message in messages:
+            self.queue.append(message)
+            try:
+                await self._process_queue()
+            except Exception as e:
+                self.queue.clear()
+                await self._await_pending()
+                failures.append((message, e))
+        return failures
+
+    async def _process_queue(self):
+        top_level, peak = self.queue[0], 0
+        try:
+            while self.queue or self.pending:
+                while self.queue:
+                    peak = max(peak, len(self.queue))
+                    message = self.queue.popleft()
+                    started = time.perf_counter()
+                    try:
+                        if isinstance(message, events.Event):
+                            self.handle_event(message)
+                        elif isinstance(message, commands.Command):
+                            await self.handle_command(message)
+                        else:
+                            raise Exception(f"{message} was not an Event or Command")
+                    finally:
+                        self._observe_message(message, started)
+                await self._await_pending()
+        finally:
+            self._observe_queue_depth(top_level, peak)
+
+    def handle_event(self, event: events.Event):
+        for handler in self.event_handlers[type(event)]:
+            started = time.perf_counter()
+            try:
+                logger.debug("handling event %s with handler %s", event, handler)
+                result = handler(event)
+                if inspect.isawaitable(result):
+                    self.pending.append(
+                        self._await_handler(result, event, handler, started)
+                    )
+                    continue
+                self.queue.extend(self.uow.collect_new_events())
+            except Exception:
+                logger.exception("Exception handling event %s", event)
+                self._count_exception(event, handler)
+            self._observe_handler(event, handler, started)
+
+    async def handle_command(self, command: commands.Command):
+        logger.debug("handling command %s", command)
+        handler = None
+        started = time.perf_counter()
+        try:
+            handler = self.command_handlers[type(command)]
+            for attempt in itertools.count(1):
+                try:
+                    result = handler(command)
+                    if inspect.isawaitable(result):
+                        await result
+                    break
+                except unit_of_work.ConcurrencyError:
+                    if attempt >= self.retry_attempts:
+                        raise
+                    await asyncio.sleep(self._retry_delay(command, attempt))
             self.queue.extend(self.uow.collect_new_events())
         except Exception:
             logger.exception("Exception handling command %s", command)
+            self._count_exception(command, handler)
             raise
+        finally:
+            self._observe_handler(command, handler, started)
+
+    async def _await_pending(self):
+        pending, self.pending = self.pending, []
+        await asyncio.gather(*pending)
+        self.queue.extend(self.uow.collect_new_events())
+
+    async def _await_handler(
+        self, awaitable: Awaitable, event: events.Event, handler, started: float
+    ):
+        try:
+            await awaitable
+        except Exception:
+            logger.exception("Exception handling event %s", event)
+            self._count_exception(event, handler)
+        finally:
+            self._observe_handler(event, handler, started)
+
+
+def handler_name(handler: Optional[Callable]) -> str:
+    return getattr(handler, "__name__", repr(handler))
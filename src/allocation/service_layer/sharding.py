@@ -0,0 +1,132 @@
+from __future__ import annotations
+import multiprocessing
+import queue
+import zlib
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+from allocation.domain import commands, model
+
+if TYPE_CHECKING:
+    from . import messagebus, unit_of_work
+
+BATCH_SIZE = 50
+
+
+class ShardedDispatcher:
+    """Routes commands by sku onto worker processes, each with its own bus.
+
+    Every command for a given sku lands on the same worker and is handled in
+    dispatch order, so per-sku ordering is preserved while different skus run
+    in parallel.  Commands are sent to workers in batches of up to batch_size.
+    """
+
+    def __init__(
+        self,
+        bus_factory: Callable[[], messagebus.MessageBus],
+        workers: int,
+        resolve_sku: Optional[Callable[[str], Optional[str]]] = None,
+        batch_size: int = BATCH_SIZE,
+        mp_context=None,
+    ):
+        ctx = mp_context or multiprocessing.get_context()
+        self.resolve_sku = resolve_sku
+        self.batch_size = batch_size
+        self.failures = []  # type: List[Tuple[commands.Command, str]]
+        self._sku_by_ref = {}  # type: Dict[str, str]
+        self._buffers = [[] for _ in range(workers)]  # type: List[List]
+        self._inboxes = [ctx.Queue() for _ in range(workers)]
+        self._outbox = ctx.Queue()
+        self._unacknowledged = 0
+        self._workers = [
+            ctx.Process(target=run_worker, args=(bus_factory, inbox, self._outbox))
+            for inbox in self._inboxes
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def __enter__(self) -> ShardedDispatcher:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def dispatch(self, cmd: commands.Command):
+        if isinstance(cmd, commands.AllocateMany):
+            lines_by_shard = defaultdict(list)
+            for line in cmd.lines:
+                lines_by_shard[self.shard_for(line.sku)].append(line)
+            for shard, lines in lines_by_shard.items():
+                self._send(shard, commands.AllocateMany(lines))
+        else:
+            self._send(self.shard_for(self.sku_for(cmd)), cmd)
+
+    def sku_for(self, cmd: commands.Command) -> str:
+        if isinstance(cmd, commands.CreateBatch):
+            self._sku_by_ref[cmd.ref] = cmd.sku
+        if isinstance(cmd, commands.ChangeBatchQuantity):
+            sku = self._sku_by_ref.get(cmd.ref)
+            if sku is None and self.resolve_sku:
+                sku = self.resolve_sku(cmd.ref)
+            if sku is None:
+                raise model.UnknownBatch(f"Unknown batch {cmd.ref}")
+            self._sku_by_ref[cmd.ref] = sku
+            return sku
+        return cmd.sku  # type: ignore
+
+    def shard_for(self, sku: str) -> int:
+        # crc32 rather than hash() so placement doesn't change between runs
+        return zlib.crc32(sku.encode()) % len(self._workers)
+
+    def flush(self):
+        for shard, buffer in enumerate(self._buffers):
+            if buffer:
+                self._inboxes[shard].put(buffer)
+                self._unacknowledged += 1
+                self._buffers[shard] = []
+
+    def join(self):
+        self.flush()
+        while self._unacknowledged:
+            try:
+                self.failures.extend(self._outbox.get(timeout=1))
+            except queue.Empty:
+                dead = [w for w in self._workers if not w.is_alive()]
+                if dead:
+                    raise RuntimeError(f"worker exited with code {dead[0].exitcode}")
+                continue
+            self._unacknowledged -= 1
+
+    def close(self):
+        self.join()
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _send(self, shard: int, cmd: commands.Command):
+        self._buffers[shard].append(cmd)
+        if len(self._buffers[shard]) >= self.batch_size:
+            self._inboxes[shard].put(self._buffers[shard])
+            self._unacknowledged += 1
+            self._buffers[shard] = []
+
+
+def run_worker(bus_factory, inbox, outbox):
+    bus = bus_factory()
+    while True:
+        batch = inbox.get()
+        if batch is None:
+            return
+        failures = bus.handle_many(batch)
+        outbox.put([(message, repr(e)) for message, e in failures])
+
+
+def sku_resolver(
+    uow: unit_of_work.AbstractUnitOfWork,
+) -> Callable[[str], Optional[str]]:
+    def resolve(ref: str) -> Optional[str]:
+        with uow:
+            product = uow.products.get_by_batchref(batchref=ref)
+            return product.sku if product else None
+
+    return resolve
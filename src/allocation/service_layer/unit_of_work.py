@@ -1,17 +1,37 @@
 # pylint: disable=attribute-defined-outside-init
 from __future__ import annotations
 import abc
-from sqlalchemy import create_engine
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+from dataclasses import asdict
+from typing import Callable, Dict, Optional, Set, Type
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm.session import Session
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm.session import Session, SessionTransaction
 
 
 from allocation import config
-from allocation.adapters import repository
+from allocation.adapters import memory_store, orm, repository
+from allocation.adapters.metrics import AbstractMetrics, NullMetrics
+from allocation.domain import events, model
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyError(Exception):
+    pass
 
 
 class AbstractUnitOfWork(abc.ABC):
     products: repository.AbstractRepository
+    metrics: AbstractMetrics = NullMetrics()
 
     def __enter__(self) -> AbstractUnitOfWork:
         return self
@@ -20,12 +40,21 @@ class AbstractUnitOfWork(abc.ABC):
         self.rollback()
 
     def commit(self):
+        started = time.perf_counter()
         self._commit()
+        self.metrics.observe("uow_commit_seconds", time.perf_counter() - started)
+
+    @contextlib.contextmanager
+    def group_commit(self):
+        """Units of work inside the block may share one transaction, committed
+        at the end; a failing one still rolls back only its own work.  By
+        default each just commits on its own."""
+        yield
 
     def collect_new_events(self):
         for product in self.products.seen:
-            while product.events:
-                yield product.events.pop(0)
+            new_events, product.events = product.events, []
+            yield from new_events
 
     @abc.abstractmethod
     def _commit(self):
@@ -36,29 +65,335 @@ class AbstractUnitOfWork(abc.ABC):
         raise NotImplementedError
 
 
-DEFAULT_SESSION_FACTORY = sessionmaker(
-    bind=create_engine(
-        config.get_postgres_uri(),
-        isolation_level="REPEATABLE READ",
+@functools.lru_cache(maxsize=None)
+def default_session_factory() -> sessionmaker:
+    # built on first use, so importing this module (or forking a worker that
+    # has) doesn't create an engine or its pool
+    return sessionmaker(
+        bind=create_engine(
+            config.get_postgres_uri(),
+            isolation_level="READ COMMITTED",
+            **config.get_pool_settings(),
+        )
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def default_replica_session_factory() -> Optional[sessionmaker]:
+    uri = config.get_replica_uri()
+    if uri is None:
+        return None
+    return sessionmaker(
+        bind=create_engine(
+            uri, isolation_level="READ COMMITTED", **config.get_pool_settings()
+        )
+    )
+
+
+REPLICA_MAX_LAG = 5.0
+REPLICA_PROBE_INTERVAL = 1.0
+
+# serialization_failure, deadlock_detected
+SERIALIZATION_FAILURES = {"40001", "40P01"}
+
+# events published to external systems, via the outbox, and their channels
+OUTBOX_CHANNELS = {
+    events.Allocated: "line_allocated",
+}  # type: Dict[Type[events.Event], str]
+
+# events the projector applies to the read model
+PROJECTED_EVENTS = {
+    events.BatchCreated,
+    events.BatchQuantityChanged,
+    events.Allocated,
+    events.Deallocated,
+}  # type: Set[Type[events.Event]]
+
+
+def default_unit_of_work() -> AbstractUnitOfWork:
+    path = config.get_memory_store_path()
+    if path:
+        return InMemoryUnitOfWork(memory_store.ProductStore(path))
+    return SqlAlchemyUnitOfWork(cache=default_product_cache())
+
+
+def default_read_unit_of_work(uow: AbstractUnitOfWork) -> ReadUnitOfWork:
+    primary = uow.session_factory if isinstance(uow, SqlAlchemyUnitOfWork) else None
+    return ReadUnitOfWork(
+        primary, default_replica_session_factory(), config.get_replica_max_lag()
     )
-)
+
+
+def default_product_cache() -> Optional[repository.ProductCache]:
+    max_weight = config.get_product_cache_weight()
+    return repository.ProductCache(max_weight) if max_weight else None
 
 
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
+    def __init__(
+        self,
+        session_factory: Optional[sessionmaker] = None,
+        cache: Optional[repository.ProductCache] = None,
+    ):
         self.session_factory = session_factory
+        self.cache = cache
+        self._committed = set()  # type: Set[model.Product]
+        self._group = None  # type: Optional[Session]
+        self._group_committed = set()  # type: Set[model.Product]
+        self._savepoint = None  # type: Optional[SessionTransaction]
 
     def __enter__(self):
-        self.session = self.session_factory()  # type: Session
-        self.products = repository.SqlAlchemyRepository(self.session)
+        if self._group is not None:
+            self.session = self._group
+            self._savepoint = self.session.begin_nested()
+        else:
+            self.session = self._new_session()
+        self.products = repository.SqlAlchemyRepository(self.session, self.cache)
         return super().__enter__()
 
     def __exit__(self, *args):
         super().__exit__(*args)
-        self.session.close()
+        if self.session is not self._group:
+            self.session.close()
+
+    @contextlib.contextmanager
+    def group_commit(self):
+        session = self._group = self._new_session()
+        try:
+            yield
+            session.commit()
+        finally:
+            committed, self._group_committed = self._group_committed, set()
+            self._group = None
+            session.close()
+        for product in committed:
+            self._cache(product)
+
+    def _new_session(self) -> Session:
+        if self.session_factory is None:
+            self.session_factory = default_session_factory()
+        session = self.session_factory()
+        if self.cache is not None:
+            # cached products have to stay loaded once their session is gone
+            session.expire_on_commit = False
+        self._check_out(session)
+        return session
+
+    def _check_out(self, session: Session):
+        # take the connection up front, so the wait for the pool is measured
+        started = time.perf_counter()
+        try:
+            pool = session.connection().engine.pool
+        except PoolTimeoutError:
+            self.metrics.increment("db_pool_timeouts_total")
+            raise
+        finally:
+            self.metrics.observe("db_checkout_seconds", time.perf_counter() - started)
+        if isinstance(pool, QueuePool):
+            self.metrics.gauge("db_pool_size", pool.size())
+            self.metrics.gauge("db_pool_checked_out", pool.checkedout())
+            self.metrics.gauge("db_pool_overflow", pool.overflow())
+
+    def _commit(self):
+        try:
+            self._commit_or_release()
+        except StaleDataError as e:
+            raise ConcurrencyError(str(e)) from e
+        except DBAPIError as e:
+            if getattr(e.orig, "pgcode", None) in SERIALIZATION_FAILURES:
+                raise ConcurrencyError(str(e)) from e
+            raise
+
+    def _commit_or_release(self):
+        self._write_outbox()
+        if self.session is not self._group:
+            self.session.commit()
+            self._committed.update(self.products.seen)
+        elif self._savepoint is not None:
+            self._savepoint.commit()
+            self._savepoint = None
+            self._group_committed.update(self.products.seen)
+
+    def _write_outbox(self):
+        messages, projected = [], []
+        for product in self.products.seen:
+            for event in product.events:
+                payload = json.dumps(asdict(event))
+                if type(event) in OUTBOX_CHANNELS:
+                    channel = OUTBOX_CHANNELS[type(event)]
+                    messages.append(dict(channel=channel, payload=payload))
+                if type(event) in PROJECTED_EVENTS:
+                    event_type = type(event).__name__
+                    projected.append(dict(event_type=event_type, payload=payload))
+        if messages:
+            self.session.execute(orm.outbox.insert(), messages)
+        if projected:
+            self.session.execute(orm.projection_queue.insert(), projected)
+
+    def collect_new_events(self):
+        yield from super().collect_new_events()
+        # products are only shared once their events have been collected
+        for product in self._committed:
+            self._cache(product)
+        self._committed.clear()
+
+    def _cache(self, product: model.Product):
+        if self.cache is not None:
+            self.cache.put(product)
+
+    def rollback(self):
+        if self.session is self._group:
+            if self._savepoint is not None:
+                self._discard_changes()
+                self._savepoint.rollback()
+                self._savepoint = None
+            return
+        if self.session.in_transaction():
+            # rolling back expires everything the session holds
+            self._committed.clear()
+        self.session.rollback()
+
+    def _discard_changes(self):
+        # a savepoint rollback only expires the mapped state it touched, so
+        # drop what the domain derived from it, and the events it raised;
+        # expired products can't be cached once the group's session closes
+        self._group_committed.difference_update(self.products.seen)
+        for product in self.products.seen:
+            product.events = []
+            product.reset_batch_index()
+            for batch in product.batches:
+                batch.reset_allocated_quantity()
+
+
+class InMemoryUnitOfWork(AbstractUnitOfWork):
+    """Products in a memory_store.ProductStore.  Nothing writes an outbox or
+    projection queue for it yet, so bootstrap won't build a bus around it."""
+
+    products: repository.InMemoryRepository
+
+    def __init__(self, store: memory_store.ProductStore):
+        self.store = store
+
+    def __enter__(self):
+        self.products = repository.InMemoryRepository(self.store)
+        return super().__enter__()
 
     def _commit(self):
-        self.session.commit()
+        # every change bumps the version, so unchanged products are skipped
+        changed = [
+            product
+            for product in self.products.seen
+            if product.version_number != self.products.loaded_versions[product.sku]
+        ]
+        if not changed:
+            return
+        try:
+            self.store.commit(
+                [
+                    (
+                        memory_store.dump_product(product),
+                        self.products.loaded_versions[product.sku],
+                    )
+                    for product in changed
+                ]
+            )
+        except memory_store.VersionConflict as e:
+            raise ConcurrencyError(str(e)) from e
+        for product in changed:
+            self.products.loaded_versions[product.sku] = product.version_number
 
     def rollback(self):
+        pass
+
+
+class ReadUnitOfWork:
+    """Sessions for views and queries, which only read.  They come from the
+    replica while it is no more than max_lag seconds behind the primary, and
+    from the primary otherwise, or when there's no replica."""
+
+    metrics: AbstractMetrics = NullMetrics()
+
+    def __init__(
+        self,
+        session_factory: Optional[sessionmaker] = None,
+        replica_session_factory: Optional[sessionmaker] = None,
+        max_lag: float = REPLICA_MAX_LAG,
+        probe_interval: float = REPLICA_PROBE_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.session_factory = session_factory
+        self.replica_session_factory = replica_session_factory
+        self.max_lag = max_lag
+        self.probe_interval = probe_interval
+        self.clock = clock
+        self._probed_at = None  # type: Optional[float]
+        self._replica_is_fresh = False
+        # views run on many request threads, and exports hold their session
+        # while the response streams
+        self._local = threading.local()
+        self._primary = None  # type: Optional[ReadUnitOfWork]
+
+    @property
+    def session(self) -> Session:
+        return self._local.session
+
+    def primary(self) -> ReadUnitOfWork:
+        """The same reads, but never from the replica."""
+        if self.replica_session_factory is None:
+            return self
+        if self._primary is None:
+            self._primary = ReadUnitOfWork(self.session_factory)
+        self._primary.metrics = self.metrics
+        return self._primary
+
+    def __enter__(self) -> ReadUnitOfWork:
+        self._local.session = self._choose_session_factory()()
+        return self
+
+    def __exit__(self, *args):
         self.session.rollback()
+        self.session.close()
+
+    def _choose_session_factory(self) -> sessionmaker:
+        replica = self.replica_session_factory
+        if replica is not None and self._replica_fresh(replica):
+            self.metrics.increment("read_uow_sessions_total", target="replica")
+            return replica
+        self.metrics.increment("read_uow_sessions_total", target="primary")
+        if self.session_factory is None:
+            self.session_factory = default_session_factory()
+        return self.session_factory
+
+    def _replica_fresh(self, replica: sessionmaker) -> bool:
+        now = self.clock()
+        if self._probed_at is None or now - self._probed_at >= self.probe_interval:
+            self._probed_at = now
+            lag = self._probe_replica(replica)
+            fresh = lag is not None and lag <= self.max_lag
+            if self._replica_is_fresh and not fresh:
+                logger.warning("replica is %s behind, reading from primary", lag)
+            self._replica_is_fresh = fresh
+        return self._replica_is_fresh
+
+    def _probe_replica(self, replica: sessionmaker) -> Optional[float]:
+        session = replica()
+        try:
+            lag = replica_lag(session)
+        except Exception:  # pylint: disable=broad-except
+            # whatever went wrong, the primary can still serve the read
+            logger.exception("Exception probing replica")
+            return None
+        finally:
+            session.close()
+        if lag is not None:
+            self.metrics.gauge("read_replica_lag_seconds", lag)
+        return lag
+
+
+def replica_lag(session: Session) -> Optional[float]:
+    """How far behind the primary a replica's data is, going by the heartbeat
+    the projector stamps on its checkpoint every poll; None if there's none."""
+    beat, now = session.execute(
+        select(func.max(orm.projector_checkpoints.c.updated_at), func.now())
+    ).one()
+    return (now - beat).total_seconds() if beat else None
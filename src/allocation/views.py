@@ -1,7 +1,26 @@
+from typing import Dict, Iterable, Iterator, List, Optional
+from sqlalchemy import func, select
+from allocation.adapters import orm
+from allocation.adapters.allocations_cache import AbstractAllocationsCache
 from allocation.service_layer import unit_of_work
 
+EXPORT_CHUNK = 1000
 
-def allocations(orderid: str, uow: unit_of_work.SqlAlchemyUnitOfWork):
+
+def allocations(
+    orderid: str,
+    uow: unit_of_work.ReadUnitOfWork,
+    cache: Optional[AbstractAllocationsCache] = None,
+):
+    generation = None
+    if cache is not None:
+        cached = cache.get(orderid)
+        if cached is not None:
+            return cached
+        # only the projector invalidates entries, and it does so as soon as
+        # the primary has a change, so a replica's older rows mustn't be cached
+        uow = uow.primary()
+        generation = cache.generation(orderid)
     with uow:
         results = uow.session.execute(
             """
@@ -9,4 +28,77 @@ def allocations(orderid: str, uow: unit_of_work.SqlAlchemyUnitOfWork):
             """,
             dict(orderid=orderid),
         )
-    return [dict(r) for r in results]
+        allocations = [dict(r) for r in results]
+    if cache is not None:
+        cache.set(orderid, allocations, generation)
+    return allocations
+
+
+def allocations_for_orders(
+    orderids: Iterable[str],
+    uow: unit_of_work.ReadUnitOfWork,
+    cache: Optional[AbstractAllocationsCache] = None,
+) -> Dict[str, List[Dict[str, str]]]:
+    found = {}  # type: Dict[str, List[Dict[str, str]]]
+    missing = []
+    for orderid in dict.fromkeys(orderids):
+        cached = cache.get(orderid) if cache is not None else None
+        if cached is not None:
+            found[orderid] = cached
+        else:
+            missing.append(orderid)
+    if not missing:
+        return found
+    generations = {}  # type: Dict[str, Optional[int]]
+    if cache is not None:
+        uow = uow.primary()
+        generations = {orderid: cache.generation(orderid) for orderid in missing}
+    fetched = {
+        orderid: [] for orderid in missing
+    }  # type: Dict[str, List[Dict[str, str]]]
+    view = orm.allocations_view
+    with uow:
+        results = uow.session.execute(
+            select(view.c.orderid, view.c.sku, view.c.batchref).where(
+                view.c.orderid.in_(missing)
+            )
+        )
+        for orderid, sku, batchref in results:
+            fetched[orderid].append(dict(sku=sku, batchref=batchref))
+    if cache is not None:
+        for orderid, allocations in fetched.items():
+            cache.set(orderid, allocations, generations[orderid])
+    return {**found, **fetched}
+
+
+def export_allocations(
+    uow: unit_of_work.ReadUnitOfWork, chunk_size: int = EXPORT_CHUNK
+) -> Iterator[List[Dict[str, str]]]:
+    """The whole of allocations_view, in chunks, from a server-side cursor
+    so only one chunk is held at a time."""
+    view = orm.allocations_view
+    with uow:
+        results = uow.session.execute(
+            select(view.c.orderid, view.c.sku, view.c.batchref)
+            .order_by(view.c.orderid, view.c.sku)
+            .execution_options(stream_results=True)
+        ).yield_per(chunk_size)
+        for rows in results.partitions():
+            yield [dict(row._mapping) for row in rows]
+
+
+def stock(sku: str, uow: unit_of_work.ReadUnitOfWork) -> Optional[int]:
+    with uow:
+        return uow.session.execute(
+            select(orm.stock_levels.c.available).where(orm.stock_levels.c.sku == sku)
+        ).scalar()
+
+
+def projection_lag(uow: unit_of_work.ReadUnitOfWork) -> float:
+    """Seconds the oldest event not yet applied to the read model has waited,
+    by the clock of the database reads are served from."""
+    with uow:
+        oldest, now = uow.session.execute(
+            select(func.min(orm.projection_queue.c.created_at), func.now())
+        ).one()
+    return (now - oldest).total_seconds() if oldest else 0.0
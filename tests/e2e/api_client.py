@@ -1,4 +1,5 @@
 import requests
+from tenacity import Retrying, stop_after_delay, wait_fixed
 from allocation import config
 
 
@@ -28,3 +29,31 @@ def post_to_allocate(orderid, sku, qty, expect_success=True):
 def get_allocation(orderid):
     url = config.get_api_url()
     return requests.get(f"{url}/allocations/{orderid}")
+
+
+def post_to_get_allocations(orderids):
+    url = config.get_api_url()
+    return requests.post(f"{url}/allocations", json={"orderids": orderids})
+
+
+def get_export(export_format):
+    url = config.get_api_url()
+    return requests.get(
+        f"{url}/export/allocations", params={"format": export_format}, stream=True
+    )
+
+
+def get_stock(sku):
+    url = config.get_api_url()
+    return requests.get(f"{url}/stock/{sku}")
+
+
+def wait_for_allocation(orderid):
+    # the read model is projected asynchronously
+    for attempt in Retrying(
+        stop=stop_after_delay(3), wait=wait_fixed(0.1), reraise=True
+    ):
+        with attempt:
+            r = get_allocation(orderid)
+            assert r.ok
+    return r
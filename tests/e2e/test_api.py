@@ -1,3 +1,4 @@
+import json
 import pytest
 from ..random_refs import random_batchref, random_orderid, random_sku
 from . import api_client
@@ -18,8 +19,7 @@ def test_happy_path_returns_202_and_batch_is_allocated():
     r = api_client.post_to_allocate(orderid, sku, qty=3)
     assert r.status_code == 202
 
-    r = api_client.get_allocation(orderid)
-    assert r.ok
+    r = api_client.wait_for_allocation(orderid)
     assert r.json() == [
         {"sku": sku, "batchref": earlybatch},
     ]
@@ -37,3 +37,51 @@ def test_unhappy_path_returns_400_and_error_message():
 
     r = api_client.get_allocation(orderid)
     assert r.status_code == 404
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_bulk_allocations_and_export():
+    sku, batch = random_sku(), random_batchref()
+    orderids = [random_orderid(str(i)) for i in range(3)]
+    api_client.post_to_add_batch(batch, sku, 100, None)
+    for orderid in orderids[:2]:
+        api_client.post_to_allocate(orderid, sku, qty=3)
+    api_client.wait_for_allocation(orderids[1])
+
+    r = api_client.post_to_get_allocations(orderids)
+    assert r.ok
+    assert r.json() == {
+        orderids[0]: [{"sku": sku, "batchref": batch}],
+        orderids[1]: [{"sku": sku, "batchref": batch}],
+        orderids[2]: [],
+    }
+
+    r = api_client.post_to_get_allocations(orderids[0])
+    assert r.status_code == 400
+    assert r.json()["message"] == "orderids must be a list of strings"
+
+    r = api_client.get_export("ndjson")
+    exported = [json.loads(line) for line in r.iter_lines() if line]
+    for orderid in orderids[:2]:
+        assert {"orderid": orderid, "sku": sku, "batchref": batch} in exported
+
+    r = api_client.get_export("csv")
+    lines = r.text.splitlines()
+    assert lines[0] == "orderid,sku,batchref"
+    assert f"{orderids[0]},{sku},{batch}" in lines
+
+
+@pytest.mark.usefixtures("postgres_db")
+@pytest.mark.usefixtures("restart_api")
+def test_stock_is_what_is_left_to_allocate():
+    sku, orderid = random_sku(), random_orderid()
+    api_client.post_to_add_batch(random_batchref(1), sku, 100, None)
+    api_client.post_to_add_batch(random_batchref(2), sku, 20, "2011-01-01")
+    api_client.post_to_allocate(orderid, sku, qty=30)
+    api_client.wait_for_allocation(orderid)
+
+    r = api_client.get_stock(sku)
+    assert r.ok
+    assert r.json() == {"sku": sku, "available": 90}
+    assert api_client.get_stock(random_sku()).status_code == 404
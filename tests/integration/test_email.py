@@ -15,7 +15,6 @@ def bus(sqlite_session_factory):
         start_orm=True,
         uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
         notifications=notifications.EmailNotifications(),
-        publish=lambda *args: None,
     )
     yield bus
     clear_mappers()
@@ -0,0 +1,180 @@
+# pylint: disable=redefined-outer-name
+from unittest import mock
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, clear_mappers, sessionmaker
+from allocation import bootstrap
+from allocation.adapters import orm, repository
+from allocation.domain import commands, events, model
+from allocation.entrypoints import projector
+from allocation.service_layer import handlers, messagebus, unit_of_work
+from .test_uow import insert_batch
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/allocation.db")
+
+    # pysqlite's own transaction handling breaks SAVEPOINT; let SQLAlchemy
+    # emit BEGIN itself
+    @event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, _):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def do_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    orm.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def uow(session_factory):
+    orm.start_mappers()
+    session = session_factory()
+    insert_batch(session, "batch1", "LAMP", 100, None)
+    session.commit()
+    yield unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    clear_mappers()
+
+
+def allocate(uow, orderid, fail=False):
+    with uow:
+        product = uow.products.get(sku="LAMP")
+        product.allocate(model.OrderLine(orderid, "LAMP", 10))
+        if fail:
+            raise ValueError(orderid)
+        uow.commit()
+    return list(uow.collect_new_events())
+
+
+def allocated_orders(session_factory):
+    session = session_factory()
+    rows = session.execute(
+        "SELECT orderid FROM order_lines JOIN allocations"
+        " ON orderline_id = order_lines.id ORDER BY orderid"
+    )
+    orderids = [orderid for orderid, in rows]
+    session.close()
+    return orderids
+
+
+def test_commits_the_group_once_at_the_end(uow, session_factory):
+    with uow.group_commit():
+        allocate(uow, "o1")
+        allocate(uow, "o2")
+        assert allocated_orders(session_factory) == []
+
+    assert allocated_orders(session_factory) == ["o1", "o2"]
+
+
+def test_a_failing_unit_of_work_rolls_back_alone(uow, session_factory):
+    with uow.group_commit():
+        allocate(uow, "o1")
+        with pytest.raises(ValueError):
+            allocate(uow, "o2", fail=True)
+        new_events = allocate(uow, "o3")
+        with uow:
+            [batch] = uow.products.get(sku="LAMP").batches
+            assert batch.available_quantity == 80
+
+    assert new_events == [events.Allocated("o3", "LAMP", 10, "batch1")]
+    assert allocated_orders(session_factory) == ["o1", "o3"]
+    [[outbox]] = session_factory().execute("SELECT COUNT(*) FROM outbox")
+    assert outbox == 2
+
+
+def test_a_failing_unit_of_work_doesnt_cache_what_it_expired(session_factory):
+    orm.start_mappers()
+    session = session_factory()
+    insert_batch(session, "batch1", "LAMP", 100, None)
+    session.commit()
+    cache = repository.ProductCache(1000)
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory, cache=cache)
+    try:
+        with uow.group_commit():
+            allocate(uow, "o1")
+            with pytest.raises(ValueError):
+                allocate(uow, "o2", fail=True)
+
+        assert allocated_orders(session_factory) == ["o1"]
+        assert len(cache) == 0
+        with uow.group_commit():
+            allocate(uow, "o1")
+            with pytest.raises(ValueError):
+                allocate(uow, "o2", fail=True)
+            allocate(uow, "o3")
+        with uow:
+            [batch] = uow.products.get(sku="LAMP").batches
+            assert batch.available_quantity == 80
+    finally:
+        clear_mappers()
+
+    assert allocated_orders(session_factory) == ["o1", "o3"]
+
+
+def test_nothing_is_committed_if_the_group_fails(uow, session_factory):
+    with pytest.raises(ValueError):
+        with uow.group_commit():
+            allocate(uow, "o1")
+            raise ValueError()
+
+    assert allocated_orders(session_factory) == []
+
+
+def test_bus_handles_a_group_in_one_transaction(session_factory):
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+        notifications=mock.Mock(),
+    )
+    assert isinstance(bus, messagebus.MessageBus)
+    try:
+        failures = bus.handle_group(
+            [
+                commands.CreateBatch("batch1", "LAMP", 100, None),
+                commands.Allocate("o1", "LAMP", 10),
+                commands.Allocate("o2", "NONEXISTENT", 10),
+                commands.Allocate("o3", "LAMP", 10),
+            ]
+        )
+    finally:
+        clear_mappers()
+
+    [(failed, error)] = failures
+    assert isinstance(failed, commands.Allocate)
+    assert failed.orderid == "o2"
+    assert isinstance(error, handlers.InvalidSku)
+    assert allocated_orders(session_factory) == ["o1", "o3"]
+    projector.project(session_factory)
+    view = session_factory().execute("SELECT orderid FROM allocations_view")
+    assert sorted(orderid for orderid, in view) == ["o1", "o3"]
+
+
+def test_bus_handles_a_groups_events_only_once_it_has_committed(session_factory):
+    notifications = mock.Mock()
+    bus = bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+        notifications=notifications,
+    )
+    assert isinstance(bus, messagebus.MessageBus)
+    group = [
+        commands.CreateBatch("batch1", "LAMP", 5, None),
+        commands.Allocate("o1", "LAMP", 10),
+    ]
+    try:
+        with mock.patch.object(Session, "commit", side_effect=ValueError()):
+            failures = bus.handle_group(group)
+        assert [failed for failed, _ in failures] == group
+        assert not notifications.send.called
+
+        assert bus.handle_group(group) == []
+    finally:
+        clear_mappers()
+
+    notifications.send.assert_called_once_with(
+        "stock@made.com", "Out of stock for LAMP"
+    )
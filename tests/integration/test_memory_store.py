@@ -0,0 +1,136 @@
+# pylint: disable=redefined-outer-name
+import os
+from datetime import date
+from unittest import mock
+import pytest
+from allocation import bootstrap
+from allocation.adapters.memory_store import LOG, SNAPSHOT, ProductStore
+from allocation.domain import commands, model
+from allocation.service_layer import handlers, unit_of_work
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "store")
+
+
+def handle(store, *cmds):
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    for cmd in cmds:
+        handlers.COMMAND_HANDLERS[type(cmd)](cmd, uow)
+
+
+def allocations(store, sku):
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    with uow:
+        return {
+            (line.orderid, batch.reference)
+            for batch in uow.products.get(sku).batches
+            for line in batch._allocations
+        }
+
+
+def test_handles_commands_in_memory(store_path):
+    store = ProductStore(store_path)
+    handle(
+        store,
+        commands.CreateBatch("b1", "LAMP", 10, None),
+        commands.CreateBatch("b2", "LAMP", 10, date(2030, 1, 1)),
+        commands.Allocate("o1", "LAMP", 8),
+        commands.Allocate("o2", "LAMP", 8),
+        commands.ChangeBatchQuantity("b1", 5),
+    )
+
+    assert allocations(store, "LAMP") == {("o2", "b2")}
+    store.close()
+
+
+def test_rebuilds_state_from_the_log(store_path):
+    store = ProductStore(store_path)
+    handle(
+        store,
+        commands.CreateBatch("b1", "LAMP", 100, date(2030, 1, 1)),
+        commands.Allocate("o1", "LAMP", 10),
+    )
+    store.close()
+
+    reopened = ProductStore(store_path)
+    assert allocations(reopened, "LAMP") == {("o1", "b1")}
+    uow = unit_of_work.InMemoryUnitOfWork(reopened)
+    with uow:
+        [batch] = uow.products.get_by_batchref("b1").batches
+        assert batch.eta == date(2030, 1, 1)
+        assert batch.available_quantity == 90
+    reopened.close()
+
+
+def test_rebuilds_state_from_a_snapshot_and_the_log(store_path):
+    store = ProductStore(store_path, checkpoint_every=2)
+    handle(
+        store,
+        commands.CreateBatch("b1", "LAMP", 100, None),
+        commands.Allocate("o1", "LAMP", 10),
+        commands.Allocate("o2", "LAMP", 10),
+    )
+    store.close()
+    assert os.path.exists(os.path.join(store_path, SNAPSHOT))
+
+    reopened = ProductStore(store_path)
+    assert allocations(reopened, "LAMP") == {("o1", "b1"), ("o2", "b1")}
+    reopened.close()
+
+
+def test_discards_a_torn_last_entry(store_path):
+    store = ProductStore(store_path)
+    handle(store, commands.CreateBatch("b1", "LAMP", 100, None))
+    store.close()
+    with open(os.path.join(store_path, LOG), "a", encoding="utf-8") as log:
+        log.write('[{"sku": "LAMP", "version_numb')
+
+    reopened = ProductStore(store_path)
+    handle(reopened, commands.Allocate("o1", "LAMP", 10))
+    reopened.close()
+
+    assert allocations(ProductStore(store_path), "LAMP") == {("o1", "b1")}
+
+
+def test_uncommitted_changes_are_not_kept(store_path):
+    store = ProductStore(store_path)
+    handle(store, commands.CreateBatch("b1", "LAMP", 100, None))
+
+    uow = unit_of_work.InMemoryUnitOfWork(store)
+    with uow:
+        uow.products.get("LAMP").allocate(model.OrderLine("o1", "LAMP", 10))
+
+    assert allocations(store, "LAMP") == set()
+    store.close()
+
+
+def test_concurrent_changes_conflict(store_path):
+    store = ProductStore(store_path)
+    handle(store, commands.CreateBatch("b1", "LAMP", 100, None))
+
+    uow1 = unit_of_work.InMemoryUnitOfWork(store)
+    uow2 = unit_of_work.InMemoryUnitOfWork(store)
+    with uow1:
+        product1 = uow1.products.get("LAMP")
+        with uow2:
+            uow2.products.get("LAMP").allocate(model.OrderLine("o2", "LAMP", 10))
+            uow2.commit()
+        product1.allocate(model.OrderLine("o1", "LAMP", 10))
+        with pytest.raises(unit_of_work.ConcurrencyError):
+            uow1.commit()
+
+    assert allocations(store, "LAMP") == {("o2", "b1")}
+    store.close()
+
+
+def test_bootstrap_refuses_the_store(store_path):
+    store = ProductStore(store_path)
+    with pytest.raises(ValueError, match="outbox"):
+        bootstrap.bootstrap(
+            start_orm=False,
+            uow=unit_of_work.InMemoryUnitOfWork(store),
+            notifications=mock.Mock(),
+        )
+    store.close()
@@ -0,0 +1,54 @@
+# pylint: disable=redefined-outer-name
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import clear_mappers
+from allocation.adapters import orm, repository
+from allocation.domain import model
+
+
+@pytest.fixture
+def count_queries(in_memory_sqlite_db):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(in_memory_sqlite_db, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(in_memory_sqlite_db, "before_cursor_execute", before_cursor_execute)
+
+
+def add_product(session, batches, allocations_per_batch):
+    product = model.Product("LAMP", batches=[])
+    for b in range(batches):
+        batch = model.Batch(f"batch-{b}", "LAMP", 100, None)
+        for i in range(allocations_per_batch):
+            batch.allocate(model.OrderLine(f"order-{b}-{i}", "LAMP", 1))
+        product.add_batch(batch)
+    session.add(product)
+    session.commit()
+
+
+@pytest.mark.parametrize(
+    "loading, queries", [("lazy", 5), ("selectin", 3), ("joined", 1)]
+)
+def test_loading_strategy_sets_the_number_of_queries(
+    loading, queries, sqlite_session_factory, count_queries
+):
+    orm.start_mappers(loading)
+    try:
+        add_product(sqlite_session_factory(), batches=3, allocations_per_batch=2)
+        count_queries.clear()
+
+        product = repository.SqlAlchemyRepository(sqlite_session_factory()).get(
+            "LAMP"
+        )
+        assert sorted(b.allocated_quantity for b in product.batches) == [2, 2, 2]
+        assert len(count_queries) == queries
+    finally:
+        clear_mappers()
+
+
+def test_unknown_loading_strategy():
+    with pytest.raises(ValueError, match="Unknown loading strategy eager"):
+        orm.start_mappers("eager")
@@ -0,0 +1,73 @@
+import json
+from unittest.mock import Mock
+import pytest
+from allocation.domain import model
+from allocation.entrypoints import outbox_relay
+from allocation.service_layer import unit_of_work
+from .test_uow import insert_batch
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+def outbox_rows(session):
+    return list(session.execute("SELECT channel, payload FROM outbox ORDER BY id"))
+
+
+def allocate(session_factory, orderid, sku, commit=True):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    with uow:
+        product = uow.products.get(sku=sku)
+        product.allocate(model.OrderLine(orderid, sku, 10))
+        if commit:
+            uow.commit()
+
+
+def test_allocated_events_are_written_in_the_same_transaction(sqlite_session_factory):
+    session = sqlite_session_factory()
+    insert_batch(session, "batch1", "LAMP", 100, None)
+    session.commit()
+
+    allocate(sqlite_session_factory, "o1", "LAMP")
+    allocate(sqlite_session_factory, "o2", "LAMP", commit=False)
+
+    [(channel, payload)] = outbox_rows(session)
+    assert channel == "line_allocated"
+    assert json.loads(payload) == {
+        "orderid": "o1",
+        "sku": "LAMP",
+        "qty": 10,
+        "batchref": "batch1",
+    }
+
+
+def test_relay_publishes_in_order_and_deletes_delivered_rows(sqlite_session_factory):
+    session = sqlite_session_factory()
+    insert_batch(session, "batch1", "LAMP", 100, None)
+    session.commit()
+    for orderid in ("o1", "o2", "o3"):
+        allocate(sqlite_session_factory, orderid, "LAMP")
+
+    publish_many = Mock()
+    assert outbox_relay.relay(sqlite_session_factory, publish_many, batch_size=2) == 2
+    assert outbox_relay.relay(sqlite_session_factory, publish_many, batch_size=2) == 1
+    assert outbox_relay.relay(sqlite_session_factory, publish_many, batch_size=2) == 0
+
+    published = [m for call in publish_many.call_args_list for m in call.args[0]]
+    assert [json.loads(payload)["orderid"] for _, payload in published] == [
+        "o1",
+        "o2",
+        "o3",
+    ]
+    assert outbox_rows(session) == []
+
+
+def test_relay_keeps_rows_if_publishing_fails(sqlite_session_factory):
+    session = sqlite_session_factory()
+    insert_batch(session, "batch1", "LAMP", 100, None)
+    session.commit()
+    allocate(sqlite_session_factory, "o1", "LAMP")
+
+    with pytest.raises(ConnectionError):
+        outbox_relay.relay(sqlite_session_factory, Mock(side_effect=ConnectionError))
+
+    assert len(outbox_rows(session)) == 1
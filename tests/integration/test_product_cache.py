@@ -0,0 +1,81 @@
+import pytest
+from allocation.adapters.repository import ProductCache
+from allocation.domain import model
+from allocation.service_layer import unit_of_work
+from .test_uow import insert_batch
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+@pytest.fixture
+def uow(sqlite_session_factory):
+    session = sqlite_session_factory()
+    insert_batch(session, "batch1", "LAMP", 100, None)
+    session.commit()
+    return unit_of_work.SqlAlchemyUnitOfWork(
+        sqlite_session_factory, cache=ProductCache(max_weight=100)
+    )
+
+
+def allocate(uow, orderid, commit=True):
+    with uow:
+        product = uow.products.get(sku="LAMP")
+        product.allocate(model.OrderLine(orderid, "LAMP", 10))
+        if commit:
+            uow.commit()
+    list(uow.collect_new_events())
+    return product
+
+
+def test_committed_products_are_reused(uow):
+    product = allocate(uow, "o1")
+
+    with uow:
+        assert uow.products.get(sku="LAMP") is product
+        assert product.batches[0].available_quantity == 90
+        product.allocate(model.OrderLine("o2", "LAMP", 10))
+        uow.commit()
+
+    session = uow.session_factory()
+    [[allocated]] = session.execute("SELECT COUNT(*) FROM allocations")
+    assert allocated == 2
+
+
+def test_finds_cached_products_by_batchref(uow):
+    product = allocate(uow, "o1")
+
+    with uow:
+        assert uow.products.get_by_batchref("batch1") is product
+
+
+def test_stale_products_are_reloaded(uow):
+    product = allocate(uow, "o1")
+    session = uow.session_factory()
+    session.execute("UPDATE products SET version_number = version_number + 1")
+    session.commit()
+
+    with uow:
+        reloaded = uow.products.get(sku="LAMP")
+        assert reloaded is not product
+        assert reloaded.version_number == product.version_number + 1
+
+
+def test_uncommitted_changes_are_not_cached(uow):
+    product = allocate(uow, "o1", commit=False)
+
+    with uow:
+        reloaded = uow.products.get(sku="LAMP")
+        assert reloaded is not product
+        assert reloaded.batches[0].available_quantity == 100
+
+
+def test_get_many_mixes_cached_and_loaded_products(uow):
+    product = allocate(uow, "o1")
+    session = uow.session_factory()
+    insert_batch(session, "batch2", "RUG", 100, None)
+    session.commit()
+
+    with uow:
+        products = uow.products.get_many(["LAMP", "RUG"])
+        assert product in products
+        assert sorted(p.sku for p in products) == ["LAMP", "RUG"]
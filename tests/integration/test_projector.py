@@ -0,0 +1,141 @@
+import json
+from sqlalchemy import event
+from allocation.adapters import orm
+from allocation.adapters.allocations_cache import InMemoryAllocationsCache
+from allocation import views
+from allocation.entrypoints import projector
+from allocation.service_layer import unit_of_work
+
+
+def enqueue(session, event_type, orderid, sku, batchref=None):
+    payload = dict(orderid=orderid, sku=sku, qty=10)
+    if batchref:
+        payload["batchref"] = batchref
+    enqueue_payload(session, event_type, payload)
+
+
+def enqueue_payload(session, event_type, payload):
+    session.execute(
+        orm.projection_queue.insert().values(
+            event_type=event_type, payload=json.dumps(payload)
+        )
+    )
+
+
+def view_rows(session):
+    return sorted(
+        session.execute("SELECT orderid, sku, batchref FROM allocations_view")
+    )
+
+
+def checkpoint(session):
+    return session.execute(
+        "SELECT position FROM projector_checkpoints WHERE name = :name",
+        dict(name=projector.NAME),
+    ).scalar()
+
+
+def test_applies_events_in_order_and_checkpoints(sqlite_session_factory):
+    session = sqlite_session_factory()
+    enqueue(session, "Allocated", "o1", "LAMP", "b1")
+    enqueue(session, "Allocated", "o2", "LAMP", "b1")
+    enqueue(session, "Deallocated", "o1", "LAMP")
+    enqueue(session, "Allocated", "o1", "LAMP", "b2")
+    session.commit()
+
+    assert projector.project(sqlite_session_factory) == 4
+
+    assert view_rows(session) == [("o1", "LAMP", "b2"), ("o2", "LAMP", "b1")]
+    assert checkpoint(session) == 4
+    assert session.execute("SELECT count(*) FROM projection_queue").scalar() == 0
+    assert projector.project(sqlite_session_factory) == 0
+
+
+def test_nets_out_each_batch_into_one_delete_and_one_insert(sqlite_session_factory):
+    session = sqlite_session_factory()
+    session.execute(
+        "INSERT INTO allocations_view (orderid, sku, batchref)"
+        " VALUES ('o1', 'LAMP', 'b0'), ('o2', 'LAMP', 'b0')"
+    )
+    for batchref in ("b1", "b2", "b3"):
+        enqueue(session, "Deallocated", "o1", "LAMP")
+        enqueue(session, "Allocated", "o1", "LAMP", batchref)
+    enqueue(session, "Deallocated", "o2", "LAMP")
+    session.commit()
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(" ".join(statement.split()[:3]))
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        projector.project(sqlite_session_factory)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    assert view_rows(session) == [("o1", "LAMP", "b3")]
+    assert statements.count("DELETE FROM allocations_view") == 1
+    assert statements.count("INSERT INTO allocations_view") == 1
+
+
+def test_applies_at_most_batch_size_events(sqlite_session_factory):
+    session = sqlite_session_factory()
+    for orderid in ("o1", "o2", "o3"):
+        enqueue(session, "Allocated", orderid, "LAMP", "b1")
+    session.commit()
+
+    assert projector.project(sqlite_session_factory, batch_size=2) == 2
+    assert checkpoint(session) == 2
+    assert projector.project(sqlite_session_factory, batch_size=2) == 1
+    assert [orderid for orderid, _, _ in view_rows(session)] == ["o1", "o2", "o3"]
+
+
+def test_invalidates_cached_allocations_once_applied(sqlite_session_factory):
+    cache = InMemoryAllocationsCache()
+    cache.set("o1", [], cache.generation("o1"))
+    cache.set("o2", [], cache.generation("o2"))
+    session = sqlite_session_factory()
+    enqueue(session, "Allocated", "o1", "LAMP", "b1")
+    session.commit()
+
+    projector.project(sqlite_session_factory, cache)
+
+    assert cache.get("o1") is None
+    assert cache.get("o2") == []
+
+
+def test_keeps_stock_levels_by_applying_net_changes(sqlite_session_factory):
+    session = sqlite_session_factory()
+    enqueue_payload(session, "BatchCreated", dict(ref="b1", sku="LAMP", qty=100))
+    enqueue(session, "Allocated", "o1", "LAMP", "b1")
+    enqueue(session, "Allocated", "o2", "LAMP", "b1")
+    session.commit()
+    projector.project(sqlite_session_factory)
+
+    enqueue_payload(session, "BatchCreated", dict(ref="b2", sku="TABLE", qty=5))
+    enqueue_payload(
+        session, "BatchQuantityChanged", dict(ref="b1", sku="LAMP", delta=-85)
+    )
+    enqueue(session, "Deallocated", "o2", "LAMP")
+    session.commit()
+    projector.project(sqlite_session_factory)
+
+    levels = session.execute("SELECT sku, available FROM stock_levels ORDER BY sku")
+    assert list(levels) == [("LAMP", 5), ("TABLE", 5)]
+
+
+def test_lag_is_the_age_of_the_oldest_unapplied_event(sqlite_session_factory):
+    uow = unit_of_work.ReadUnitOfWork(sqlite_session_factory)
+    assert views.projection_lag(uow) == 0
+    session = sqlite_session_factory()
+    session.execute(
+        orm.projection_queue.insert().values(
+            event_type="Allocated",
+            payload="{}",
+            created_at=orm.func.datetime("now", "-30 seconds"),
+        )
+    )
+    session.commit()
+
+    assert 30 <= views.projection_lag(uow) < 40
@@ -0,0 +1,66 @@
+# pylint: disable=redefined-outer-name
+from unittest import mock
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import clear_mappers
+from allocation import bootstrap, views
+from allocation.domain import commands
+from allocation.entrypoints import projector
+from allocation.service_layer import unit_of_work
+
+# the projector reads the oldest events in rowid order, stopping at its limit
+HEAD_OF_QUEUE = "SCAN projection_queue"
+
+
+@pytest.fixture
+def statements(in_memory_sqlite_db):
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if not many and not statement.lstrip().upper().startswith("INSERT"):
+            captured.append((statement, parameters))
+
+    event.listen(in_memory_sqlite_db, "before_cursor_execute", before_cursor_execute)
+    yield captured
+    event.remove(in_memory_sqlite_db, "before_cursor_execute", before_cursor_execute)
+
+
+def full_scans(engine, statement, parameters):
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+        details = [row.detail for row in plan]
+    return [
+        d
+        for d in details
+        if d.startswith("SCAN ")
+        and " USING " not in d
+        and "CONSTANT ROW" not in d  # the values of an IN list
+        and d != HEAD_OF_QUEUE
+    ]
+
+
+def test_hot_queries_use_indexes(
+    sqlite_session_factory, in_memory_sqlite_db, statements
+):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    bus = bootstrap.bootstrap(start_orm=True, uow=uow, notifications=mock.Mock())
+    try:
+        bus.handle(commands.CreateBatch("batch1", "LAMP", 20, None))
+        bus.handle(commands.CreateBatch("batch2", "LAMP", 20, None))
+        bus.handle(commands.Allocate("o1", "LAMP", 10))
+        bus.handle(commands.Allocate("o2", "LAMP", 5))
+        # deallocates both orders, so the projector deletes more than one
+        bus.handle(commands.ChangeBatchQuantity("batch1", 4))
+        projector.project(sqlite_session_factory)
+        views.allocations("o1", bus.read_uow)
+    finally:
+        clear_mappers()
+
+    assert statements
+    scans = {
+        statement: scans
+        for statement, parameters in set(statements)
+        for scans in [full_scans(in_memory_sqlite_db, statement, parameters)]
+        if scans
+    }
+    assert scans == {}
@@ -0,0 +1,139 @@
+# pylint: disable=redefined-outer-name
+from unittest import mock
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from allocation import bootstrap, views
+from allocation.adapters import orm
+from allocation.adapters.allocations_cache import InMemoryAllocationsCache
+from allocation.adapters.metrics import PrometheusMetrics
+from allocation.entrypoints import projector
+from allocation.service_layer import unit_of_work
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def database(path, available):
+    engine = create_engine(f"sqlite:///{path}")
+    orm.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    session = session_factory()
+    session.execute(orm.stock_levels.insert().values(sku="LAMP", available=available))
+    session.commit()
+    return session_factory
+
+
+@pytest.fixture
+def primary(tmp_path):
+    return database(tmp_path / "primary.db", available=10)
+
+
+@pytest.fixture
+def replica(tmp_path):
+    # a replica that hasn't caught up with the primary yet
+    return database(tmp_path / "replica.db", available=7)
+
+
+def beat(session_factory, seconds_ago):
+    session = session_factory()
+    session.execute(
+        orm.projector_checkpoints.update().values(
+            updated_at=orm.func.datetime("now", f"-{seconds_ago} seconds")
+        )
+    )
+    session.commit()
+
+
+def test_reads_from_a_replica_within_max_lag(primary, replica):
+    projector.project(replica)
+    read_uow = unit_of_work.ReadUnitOfWork(primary, replica, max_lag=5)
+    read_uow.metrics = PrometheusMetrics()
+
+    assert views.stock("LAMP", read_uow) == 7
+    assert 'read_uow_sessions_total{target="replica"} 1' in read_uow.metrics.render()
+
+
+def test_falls_back_to_the_primary_past_max_lag(primary, replica):
+    projector.project(replica)
+    beat(replica, seconds_ago=60)
+    read_uow = unit_of_work.ReadUnitOfWork(primary, replica, max_lag=5)
+
+    assert views.stock("LAMP", read_uow) == 10
+
+
+def test_falls_back_to_the_primary_without_a_heartbeat(primary, replica):
+    read_uow = unit_of_work.ReadUnitOfWork(primary, replica)
+
+    assert views.stock("LAMP", read_uow) == 10
+
+
+def test_falls_back_to_the_primary_if_the_replica_is_down(primary, tmp_path):
+    unreachable = sessionmaker(bind=create_engine(f"sqlite:///{tmp_path}/no/such.db"))
+    read_uow = unit_of_work.ReadUnitOfWork(primary, unreachable)
+
+    assert views.stock("LAMP", read_uow) == 10
+
+
+def test_falls_back_to_the_primary_if_the_probe_fails(primary, replica):
+    projector.project(replica)
+    read_uow = unit_of_work.ReadUnitOfWork(primary, replica)
+
+    with mock.patch.object(unit_of_work, "replica_lag", side_effect=TypeError):
+        assert views.stock("LAMP", read_uow) == 10
+
+
+def test_cache_misses_are_read_from_the_primary(primary, replica):
+    for session_factory, batchref in ((primary, "b2"), (replica, "b1")):
+        session = session_factory()
+        session.execute(
+            orm.allocations_view.insert().values(
+                orderid="o1", sku="LAMP", batchref=batchref
+            )
+        )
+        session.commit()
+    projector.project(replica)
+    read_uow = unit_of_work.ReadUnitOfWork(primary, replica, max_lag=5)
+    cache = InMemoryAllocationsCache()
+    current = [{"sku": "LAMP", "batchref": "b2"}]
+
+    assert views.allocations("o1", read_uow) == [{"sku": "LAMP", "batchref": "b1"}]
+    assert views.allocations("o1", read_uow, cache) == current
+    assert views.allocations_for_orders(["o1", "o2"], read_uow, cache) == {
+        "o1": current,
+        "o2": [],
+    }
+    assert cache.get("o1") == current
+    assert cache.get("o2") == []
+
+
+def test_probes_the_replica_at_most_once_per_interval(primary, replica):
+    projector.project(replica)
+    clock = FakeClock()
+    read_uow = unit_of_work.ReadUnitOfWork(
+        primary, replica, max_lag=5, probe_interval=1, clock=clock
+    )
+    assert views.stock("LAMP", read_uow) == 7
+
+    beat(replica, seconds_ago=60)
+    clock.now = 0.9
+    assert views.stock("LAMP", read_uow) == 7
+    clock.now = 1
+    assert views.stock("LAMP", read_uow) == 10
+
+
+def test_bootstrap_reads_from_the_write_database_without_a_replica(primary):
+    bus = bootstrap.bootstrap(
+        start_orm=False,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(primary),
+        notifications=mock.Mock(),
+    )
+
+    assert bus.read_uow.session_factory is primary
+    assert bus.read_uow.replica_session_factory is None
+    assert views.stock("LAMP", bus.read_uow) == 10
@@ -1,4 +1,5 @@
 import pytest
+from sqlalchemy import event
 from allocation.adapters import repository
 from allocation.domain import model
 
@@ -17,3 +18,63 @@ def test_get_by_batchref(sqlite_session_factory):
     repo.add(p2)
     assert repo.get_by_batchref("b2") == p1
     assert repo.get_by_batchref("b3") == p2
+
+
+def test_allocated_quantity_is_rebuilt_on_load(sqlite_session_factory):
+    session = sqlite_session_factory()
+    batch = model.Batch(ref="b1", sku="sku1", qty=100, eta=None)
+    batch.allocate(model.OrderLine("o1", "sku1", 10))
+    batch.allocate(model.OrderLine("o2", "sku1", 20))
+    repository.SqlAlchemyRepository(session).add(
+        model.Product(sku="sku1", batches=[batch])
+    )
+    session.commit()
+
+    repo = repository.SqlAlchemyRepository(sqlite_session_factory())
+    [loaded] = repo.get("sku1").batches
+    assert loaded is not batch
+    assert loaded.allocated_quantity == 30
+    assert loaded.available_quantity == 70
+
+
+def add_products(session_factory, count):
+    session = session_factory()
+    repository.SqlAlchemyRepository(session).add_many(
+        model.Product(
+            sku=f"sku{i}",
+            batches=[
+                model.Batch(ref=f"b{i}-{j}", sku=f"sku{i}", qty=100, eta=None)
+                for j in range(3)
+            ],
+        )
+        for i in range(count)
+    )
+    session.commit()
+
+
+def test_get_many_uses_a_fixed_number_of_queries(
+    sqlite_session_factory, in_memory_sqlite_db
+):
+    add_products(sqlite_session_factory, 10)
+    repo = repository.SqlAlchemyRepository(sqlite_session_factory())
+    queries = []
+    event.listen(
+        in_memory_sqlite_db, "before_cursor_execute", lambda *a: queries.append(a)
+    )
+
+    products = repo.get_many([f"sku{i}" for i in range(8)] + ["nonexistent"])
+
+    assert sorted(p.sku for p in products) == [f"sku{i}" for i in range(8)]
+    assert all(len(p.batches) == 3 for p in products)
+    assert repo.seen == set(products)
+    assert len(queries) == 3  # products, then selectin for batches and allocations
+
+
+def test_get_many_by_batchrefs(sqlite_session_factory):
+    add_products(sqlite_session_factory, 3)
+    repo = repository.SqlAlchemyRepository(sqlite_session_factory())
+
+    products = repo.get_many_by_batchrefs(["b0-0", "b0-2", "b2-1", "nonexistent"])
+
+    assert sorted(p.sku for p in products) == ["sku0", "sku2"]
+    assert repo.seen == set(products)
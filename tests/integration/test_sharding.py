@@ -0,0 +1,79 @@
+# pylint: disable=redefined-outer-name
+import functools
+from unittest import mock
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from allocation import bootstrap
+from allocation.adapters.orm import metadata
+from allocation.domain import commands, model
+from allocation.service_layer import sharding, unit_of_work
+
+
+def make_bus(db_uri):
+    return bootstrap.bootstrap(
+        start_orm=True,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(
+            sessionmaker(bind=create_engine(db_uri))
+        ),
+        notifications=mock.Mock(),
+    )
+
+
+@pytest.fixture
+def sqlite_file_db(tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'allocation.db'}"
+    engine = create_engine(db_uri)
+    metadata.create_all(engine)
+    return db_uri, engine
+
+
+def allocated_batchrefs(engine):
+    rows = engine.execute(
+        "SELECT o.orderid, b.reference FROM allocations AS a"
+        " JOIN order_lines AS o ON a.orderline_id = o.id"
+        " JOIN batches AS b ON a.batch_id = b.id"
+    )
+    return dict(list(rows))
+
+
+def test_commands_for_each_sku_are_handled_in_order(sqlite_file_db):
+    db_uri, engine = sqlite_file_db
+    skus = [f"sku{i}" for i in range(6)]
+    with sharding.ShardedDispatcher(
+        functools.partial(make_bus, db_uri), workers=3, batch_size=4
+    ) as dispatcher:
+        for sku in skus:
+            dispatcher.dispatch(commands.CreateBatch(f"{sku}-early", sku, 10, None))
+            dispatcher.dispatch(commands.CreateBatch(f"{sku}-late", sku, 10, None))
+            dispatcher.dispatch(commands.Allocate(f"{sku}-order", sku, 10))
+            dispatcher.dispatch(commands.ChangeBatchQuantity(f"{sku}-early", 5))
+
+    assert dispatcher.failures == []
+    assert allocated_batchrefs(engine) == {
+        f"{sku}-order": f"{sku}-late" for sku in skus
+    }
+
+
+def test_resolves_unseen_batchrefs_to_skus(sqlite_file_db):
+    db_uri, engine = sqlite_file_db
+    engine.execute("INSERT INTO products (sku, version_number) VALUES ('sku1', 0)")
+    engine.execute(
+        "INSERT INTO batches (reference, sku, _purchased_quantity)"
+        " VALUES ('batch1', 'sku1', 10)"
+    )
+    lookups = []
+
+    def resolve_sku(ref):
+        lookups.append(ref)
+        return "sku1" if ref == "batch1" else None
+
+    with sharding.ShardedDispatcher(
+        functools.partial(make_bus, db_uri), workers=2, resolve_sku=resolve_sku
+    ) as dispatcher:
+        assert dispatcher.sku_for(commands.ChangeBatchQuantity("batch1", 5)) == "sku1"
+        assert dispatcher.sku_for(commands.ChangeBatchQuantity("batch1", 3)) == "sku1"
+        with pytest.raises(model.UnknownBatch):
+            dispatcher.dispatch(commands.ChangeBatchQuantity("batch2", 5))
+
+    assert lookups == ["batch1", "batch2"]
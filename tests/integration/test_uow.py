@@ -5,6 +5,11 @@ import traceback
 from typing import List
 from unittest.mock import Mock
 import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from allocation.adapters import orm
+from allocation.adapters.metrics import PrometheusMetrics
 from allocation.domain import model
 from allocation.service_layer import unit_of_work
 from ..random_refs import random_sku, random_batchref, random_orderid
@@ -118,7 +123,7 @@ def test_concurrent_updates_to_version_are_not_allowed(postgres_session_factory)
     )
     assert version == 2
     [exception] = exceptions
-    assert "could not serialize access due to concurrent update" in str(exception)
+    assert isinstance(exception, unit_of_work.ConcurrencyError)
 
     orders = session.execute(
         "SELECT orderid FROM allocations"
@@ -130,3 +135,45 @@ def test_concurrent_updates_to_version_are_not_allowed(postgres_session_factory)
     assert orders.rowcount == 1
     with unit_of_work.SqlAlchemyUnitOfWork(postgres_session_factory) as uow:
         uow.session.execute("select 1")
+
+
+def test_commit_fails_if_the_product_changed_since_it_was_loaded(
+    sqlite_session_factory,
+):
+    session = sqlite_session_factory()
+    insert_batch(session, "batch1", "ASYMMETRICAL-DRESSER", 100, None)
+    session.commit()
+
+    uow1 = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    uow2 = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    with uow1:
+        product1 = uow1.products.get(sku="ASYMMETRICAL-DRESSER")
+        with uow2:
+            product2 = uow2.products.get(sku="ASYMMETRICAL-DRESSER")
+            product2.allocate(model.OrderLine("o2", "ASYMMETRICAL-DRESSER", 10))
+            uow2.commit()
+        product1.allocate(model.OrderLine("o1", "ASYMMETRICAL-DRESSER", 10))
+        with pytest.raises(unit_of_work.ConcurrencyError):
+            uow1.commit()
+
+    assert get_allocated_batch_ref(session, "o2", "ASYMMETRICAL-DRESSER") == "batch1"
+    [[version]] = session.execute("SELECT version_number FROM products")
+    assert version == 2
+
+
+def test_records_pool_checkout_statistics(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path}/allocation.db", poolclass=QueuePool, pool_size=2
+    )
+    orm.metadata.create_all(engine)
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine))
+    uow.metrics = PrometheusMetrics()
+
+    with uow:
+        assert uow.metrics.gauges["db_pool_checked_out"][()] == 1
+        assert uow.metrics.gauges["db_pool_size"][()] == 2
+    with uow:
+        pass
+
+    [checkouts] = uow.metrics.histograms["db_checkout_seconds"].values()
+    assert sum(checkouts[:-1]) == 2
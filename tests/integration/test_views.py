@@ -1,10 +1,13 @@
 # pylint: disable=redefined-outer-name
 from datetime import date
+from sqlalchemy import event
 from sqlalchemy.orm import clear_mappers
 from unittest import mock
 import pytest
 from allocation import bootstrap, views
+from allocation.adapters.allocations_cache import InMemoryAllocationsCache
 from allocation.domain import commands
+from allocation.entrypoints import projector
 from allocation.service_layer import unit_of_work
 
 today = date.today()
@@ -16,7 +19,6 @@ def sqlite_bus(sqlite_session_factory):
         start_orm=True,
         uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
         notifications=mock.Mock(),
-        publish=lambda *args: None,
     )
     yield bus
     clear_mappers()
@@ -31,8 +33,9 @@ def test_allocations_view(sqlite_bus):
     sqlite_bus.handle(commands.CreateBatch("sku1batch-later", "sku1", 50, today))
     sqlite_bus.handle(commands.Allocate("otherorder", "sku1", 30))
     sqlite_bus.handle(commands.Allocate("otherorder", "sku2", 10))
+    projector.project(sqlite_bus.uow.session_factory)
 
-    assert views.allocations("order1", sqlite_bus.uow) == [
+    assert views.allocations("order1", sqlite_bus.read_uow) == [
         {"sku": "sku1", "batchref": "sku1batch"},
         {"sku": "sku2", "batchref": "sku2batch"},
     ]
@@ -43,7 +46,139 @@ def test_deallocation(sqlite_bus):
     sqlite_bus.handle(commands.CreateBatch("b2", "sku1", 50, today))
     sqlite_bus.handle(commands.Allocate("o1", "sku1", 40))
     sqlite_bus.handle(commands.ChangeBatchQuantity("b1", 10))
+    projector.project(sqlite_bus.uow.session_factory)
 
-    assert views.allocations("o1", sqlite_bus.uow) == [
+    assert views.allocations("o1", sqlite_bus.read_uow) == [
         {"sku": "sku1", "batchref": "b2"},
     ]
+
+
+def test_cached_allocations_match_the_view(sqlite_session_factory):
+    cache = InMemoryAllocationsCache()
+    bus = bootstrap.bootstrap(
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        notifications=mock.Mock(),
+    )
+    uow = bus.read_uow
+    try:
+
+        def check(orderid):
+            projector.project(sqlite_session_factory, cache)
+            expected = views.allocations(orderid, uow)
+            assert views.allocations(orderid, uow, cache) == expected
+            hits = cache.hits
+            assert views.allocations(orderid, uow, cache) == expected
+            assert cache.hits == hits + 1
+
+        bus.handle(commands.CreateBatch("b1", "sku1", 50, None))
+        bus.handle(commands.CreateBatch("b2", "sku1", 50, today))
+        check("o1")
+        bus.handle(commands.Allocate("o1", "sku1", 40))
+        check("o1")
+        bus.handle(commands.Allocate("o2", "sku1", 5))
+        check("o1")
+        check("o2")
+        bus.handle(commands.ChangeBatchQuantity("b1", 10))
+        check("o1")
+        check("o2")
+    finally:
+        clear_mappers()
+
+    assert views.allocations("o1", uow, cache) == [{"sku": "sku1", "batchref": "b2"}]
+
+
+def test_a_lookup_that_races_the_projector_isnt_cached(sqlite_bus):
+    session_factory = sqlite_bus.uow.session_factory
+
+    class RacingCache(InMemoryAllocationsCache):
+        def set(self, orderid, allocations, generation):
+            # the projector commits between the lookup's read and its set
+            projector.project(session_factory, self)
+            super().set(orderid, allocations, generation)
+
+    cache = RacingCache()
+    sqlite_bus.handle(commands.CreateBatch("b1", "sku1", 50, None))
+    sqlite_bus.handle(commands.Allocate("o1", "sku1", 10))
+
+    assert views.allocations("o1", sqlite_bus.read_uow, cache) == []
+    assert views.allocations("o1", sqlite_bus.read_uow, cache) == [
+        {"sku": "sku1", "batchref": "b1"}
+    ]
+
+
+def test_allocations_for_orders_in_one_query(sqlite_bus):
+    sqlite_bus.handle(commands.CreateBatch("b1", "sku1", 50, None))
+    sqlite_bus.handle(commands.CreateBatch("b2", "sku2", 50, None))
+    sqlite_bus.handle(commands.Allocate("o1", "sku1", 10))
+    sqlite_bus.handle(commands.Allocate("o1", "sku2", 10))
+    sqlite_bus.handle(commands.Allocate("o2", "sku1", 10))
+    projector.project(sqlite_bus.uow.session_factory)
+    cache = InMemoryAllocationsCache()
+    orderids = ["o1", "o2", "o3", "o1"]
+    queries = []
+    engine = sqlite_bus.read_uow.session_factory.kw["bind"]
+    event.listen(engine, "before_cursor_execute", lambda *args: queries.append(1))
+
+    result = views.allocations_for_orders(orderids, sqlite_bus.read_uow, cache)
+
+    assert len(queries) == 1
+    assert result == {
+        orderid: views.allocations(orderid, sqlite_bus.read_uow)
+        for orderid in orderids
+    }
+    assert result["o3"] == []
+    assert (
+        views.allocations_for_orders(orderids, sqlite_bus.read_uow, cache) == result
+    )
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+def test_export_streams_the_whole_view_in_chunks(sqlite_bus):
+    sqlite_bus.handle(commands.CreateBatch("b1", "sku1", 50, None))
+    for i in range(5):
+        sqlite_bus.handle(commands.Allocate(f"o{i}", "sku1", 1))
+    projector.project(sqlite_bus.uow.session_factory)
+
+    chunks = list(views.export_allocations(sqlite_bus.read_uow, chunk_size=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [row for chunk in chunks for row in chunk] == [
+        {"orderid": f"o{i}", "sku": "sku1", "batchref": "b1"} for i in range(5)
+    ]
+
+
+def test_stock_matches_the_available_quantity_of_the_product(sqlite_bus):
+    def available(sku):
+        with sqlite_bus.uow:
+            product = sqlite_bus.uow.products.get(sku=sku)
+            return sum(b.available_quantity for b in product.batches)
+
+    def check(sku):
+        projector.project(sqlite_bus.uow.session_factory)
+        assert views.stock(sku, sqlite_bus.read_uow) == available(sku)
+
+    assert views.stock("sku1", sqlite_bus.read_uow) is None
+    sqlite_bus.handle(commands.CreateBatch("b1", "sku1", 50, None))
+    sqlite_bus.handle(commands.CreateBatch("b2", "sku1", 50, today))
+    sqlite_bus.handle(commands.CreateBatch("b3", "sku2", 20, None))
+    check("sku1")
+    sqlite_bus.handle(commands.Allocate("o1", "sku1", 40))
+    sqlite_bus.handle(commands.Allocate("o2", "sku1", 5))
+    sqlite_bus.handle(commands.Allocate("o3", "sku2", 5))
+    check("sku1")
+    sqlite_bus.handle(commands.ChangeBatchQuantity("b1", 10))
+    check("sku1")
+    check("sku2")
+    assert views.stock("sku1", sqlite_bus.read_uow) == 15
+
+
+def test_allocating_the_same_line_twice_is_projected_once(sqlite_bus):
+    sqlite_bus.handle(commands.CreateBatch("b1", "sku1", 20, None))
+    sqlite_bus.handle(commands.Allocate("o1", "sku1", 5))
+    sqlite_bus.handle(commands.Allocate("o1", "sku1", 5))
+    projector.project(sqlite_bus.uow.session_factory)
+
+    assert views.stock("sku1", sqlite_bus.read_uow) == 15
+    assert views.allocations("o1", sqlite_bus.read_uow) == [
+        {"sku": "sku1", "batchref": "b1"}
+    ]
@@ -0,0 +1,106 @@
+import os
+from unittest import mock
+import pytest
+from allocation.adapters.allocations_cache import (
+    InMemoryAllocationsCache,
+    NullAllocationsCache,
+    default_allocations_cache,
+)
+from allocation.adapters.metrics import PrometheusMetrics
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+ROWS = [{"sku": "LAMP", "batchref": "b1"}]
+
+
+def fill(cache, orderid, rows=ROWS):
+    cache.set(orderid, rows, cache.generation(orderid))
+
+
+def test_counts_hits_and_misses():
+    cache = InMemoryAllocationsCache()
+    cache.metrics = PrometheusMetrics()
+    assert cache.get("o1") is None
+    fill(cache, "o1")
+
+    assert cache.get("o1") == ROWS
+    assert cache.get("o1") == ROWS
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cache.hit_ratio == 2 / 3
+    assert 'allocations_cache_lookups_total{result="hit"} 2' in cache.metrics.render()
+
+
+def test_evicts_least_recently_used():
+    cache = InMemoryAllocationsCache(max_entries=2)
+    fill(cache, "o1")
+    fill(cache, "o2")
+    cache.get("o1")
+    fill(cache, "o3")
+
+    assert cache.get("o2") is None
+    assert cache.get("o1") == cache.get("o3") == ROWS
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = InMemoryAllocationsCache(ttl=10, clock=clock)
+    fill(cache, "o1")
+    clock.now = 9.9
+    assert cache.get("o1") == ROWS
+
+    clock.now = 10
+    assert cache.get("o1") is None
+
+
+def test_invalidate():
+    cache = InMemoryAllocationsCache()
+    fill(cache, "o1")
+    cache.invalidate("o1")
+    assert cache.get("o1") is None
+
+
+def test_empty_results_expire_sooner():
+    clock = FakeClock()
+    cache = InMemoryAllocationsCache(ttl=10, empty_ttl=1, clock=clock)
+    fill(cache, "o1", [])
+    fill(cache, "o2")
+    clock.now = 1
+
+    assert cache.get("o1") is None
+    assert cache.get("o2") == ROWS
+
+
+def test_doesnt_cache_a_lookup_that_raced_an_invalidation():
+    cache = InMemoryAllocationsCache()
+    o1, o2 = cache.generation("o1"), cache.generation("o2")
+    cache.invalidate("o1")
+    cache.set("o1", [], o1)
+    cache.set("o2", ROWS, o2)
+
+    assert cache.get("o1") is None
+    assert cache.get("o2") == ROWS
+
+
+def test_invalidations_it_has_forgotten_still_count():
+    cache = InMemoryAllocationsCache(max_entries=1)
+    generation = cache.generation("o1")
+    cache.invalidate("o1")
+    cache.invalidate("o2")
+    cache.set("o1", [], generation)
+
+    assert cache.get("o1") is None
+
+
+def test_only_caches_the_projector_can_invalidate_are_configurable():
+    with mock.patch.dict(os.environ, {"ALLOCATIONS_CACHE": "none"}):
+        assert isinstance(default_allocations_cache(), NullAllocationsCache)
+    with mock.patch.dict(os.environ, {"ALLOCATIONS_CACHE": "memory"}):
+        with pytest.raises(ValueError, match="Unknown allocations cache memory"):
+            default_allocations_cache()
@@ -44,3 +44,36 @@ def test_allocation_is_idempotent():
     batch.allocate(line)
     batch.allocate(line)
     assert batch.available_quantity == 18
+
+
+def test_deallocating_restores_the_available_quantity():
+    batch, line = make_batch_and_line("WOBBLY-STOOL", 20, 2)
+    batch.allocate(line)
+
+    batch.deallocate(line)
+    assert batch.available_quantity == 20
+
+
+def test_deallocate_excess_frees_the_fewest_lines():
+    batch = Batch("batch-001", "WOBBLY-STOOL", 100, eta=None)
+    small_lines = [OrderLine(f"order-{i}", "WOBBLY-STOOL", 10) for i in range(5)]
+    large_line = OrderLine("order-large", "WOBBLY-STOOL", 30)
+    for line in small_lines + [large_line]:
+        batch.allocate(line)
+
+    batch._purchased_quantity = 65
+
+    assert batch.deallocate_excess() == [large_line]
+    assert batch.available_quantity == 15
+
+
+def test_deallocate_excess_frees_the_smallest_line_that_covers_it():
+    batch = Batch("batch-001", "WOBBLY-STOOL", 100, eta=None)
+    lines = [OrderLine(f"order-{qty}", "WOBBLY-STOOL", qty) for qty in (10, 50, 30)]
+    for line in lines:
+        batch.allocate(line)
+
+    batch._purchased_quantity = 85
+
+    assert batch.deallocate_excess() == [lines[0]]
+    assert batch.available_quantity == 5
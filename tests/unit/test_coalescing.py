@@ -0,0 +1,87 @@
+from allocation.domain import commands
+from allocation.service_layer.coalescing import CommandCoalescer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeBus:
+    def __init__(self):
+        self.handled = []
+        self.metrics = FakeMetrics()
+
+    def handle_group(self, messages):
+        self.handled.append(messages)
+        return []
+
+
+class FakeMetrics:
+    def __init__(self):
+        self.counts = {}
+
+    def increment(self, name, amount=1, **labels):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+
+def test_keeps_only_the_latest_quantity_per_batch():
+    bus = FakeBus()
+    coalescer = CommandCoalescer(bus, window=1)
+    coalescer.submit(commands.ChangeBatchQuantity("batch1", 50))
+    coalescer.submit(commands.ChangeBatchQuantity("batch2", 20))
+    coalescer.submit(commands.ChangeBatchQuantity("batch1", 40))
+    coalescer.submit(commands.ChangeBatchQuantity("batch1", 30))
+
+    coalescer.flush()
+
+    assert bus.handled == [
+        [
+            commands.ChangeBatchQuantity("batch2", 20),
+            commands.ChangeBatchQuantity("batch1", 30),
+        ]
+    ]
+    assert coalescer.elided == 2
+    assert bus.metrics.counts == {"commands_coalesced_total": 2}
+
+
+def test_other_commands_are_passed_through_in_order():
+    bus = FakeBus()
+    coalescer = CommandCoalescer(bus, window=1)
+    first = commands.Allocate("o1", "sku1", 10)
+    second = commands.Allocate("o1", "sku1", 10)
+    coalescer.submit(first)
+    coalescer.submit(second)
+
+    coalescer.flush()
+
+    assert bus.handled == [[first, second]]
+    assert coalescer.elided == 0
+
+
+def test_is_due_once_the_window_has_passed():
+    clock = FakeClock()
+    coalescer = CommandCoalescer(FakeBus(), window=0.5, clock=clock)
+    assert coalescer.time_left() is None
+    assert not coalescer.due()
+
+    coalescer.submit(commands.ChangeBatchQuantity("batch1", 50))
+    clock.now = 0.2
+    assert coalescer.time_left() == 0.3
+    assert not coalescer.due()
+
+    clock.now = 0.5
+    assert coalescer.due()
+    coalescer.flush()
+    assert coalescer.time_left() is None
+
+
+def test_is_due_when_too_many_commands_are_pending():
+    coalescer = CommandCoalescer(FakeBus(), window=10, max_pending=2)
+    coalescer.submit(commands.ChangeBatchQuantity("batch1", 50))
+    assert not coalescer.due()
+    coalescer.submit(commands.ChangeBatchQuantity("batch2", 50))
+    assert coalescer.due()
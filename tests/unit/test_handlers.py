@@ -1,13 +1,16 @@
 # pylint: disable=no-self-use
 from __future__ import annotations
+import asyncio
+import threading
 from collections import defaultdict
 from datetime import date
 from typing import Dict, List
+from unittest import mock
 import pytest
 from allocation import bootstrap
-from allocation.domain import commands
-from allocation.service_layer import handlers
-from allocation.adapters import notifications, repository
+from allocation.domain import commands, model
+from allocation.service_layer import handlers, messagebus
+from allocation.adapters import metrics, notifications, repository
 from allocation.service_layer import unit_of_work
 
 
@@ -19,15 +22,28 @@ class FakeRepository(repository.AbstractRepository):
     def _add(self, product):
         self._products.add(product)
 
+    def _add_many(self, products):
+        self._products.update(products)
+
     def _get(self, sku):
         return next((p for p in self._products if p.sku == sku), None)
 
+    def _get_many(self, skus):
+        return [p for p in self._products if p.sku in skus]
+
     def _get_by_batchref(self, batchref):
         return next(
             (p for p in self._products for b in p.batches if b.reference == batchref),
             None,
         )
 
+    def _get_many_by_batchrefs(self, batchrefs):
+        return [
+            p
+            for p in self._products
+            if any(b.reference in batchrefs for b in p.batches)
+        ]
+
 
 class FakeUnitOfWork(unit_of_work.AbstractUnitOfWork):
     def __init__(self):
@@ -54,7 +70,6 @@ def bootstrap_test_app():
         start_orm=False,
         uow=FakeUnitOfWork(),
         notifications=FakeNotifications(),
-        publish=lambda *args: None,
     )
 
 
@@ -101,7 +116,6 @@ class TestAllocate:
             start_orm=False,
             uow=FakeUnitOfWork(),
             notifications=fake_notifs,
-            publish=lambda *args: None,
         )
         bus.handle(commands.CreateBatch("b1", "POPULAR-CURTAINS", 9, None))
         bus.handle(commands.Allocate("o1", "POPULAR-CURTAINS", 10))
@@ -110,6 +124,46 @@ class TestAllocate:
         ]
 
 
+class TestAllocateMany:
+    def test_allocates_every_line_in_one_commit(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "CHUNKY-SOFA", 10, None))
+        bus.handle(commands.CreateBatch("b2", "LEATHER-POUF", 10, None))
+        bus.uow.committed = False
+
+        bus.handle(
+            commands.AllocateMany(
+                [
+                    commands.Allocate("o1", "CHUNKY-SOFA", 4),
+                    commands.Allocate("o1", "LEATHER-POUF", 3),
+                    commands.Allocate("o2", "CHUNKY-SOFA", 5),
+                ]
+            )
+        )
+
+        [sofas] = bus.uow.products.get("CHUNKY-SOFA").batches
+        [poufs] = bus.uow.products.get("LEATHER-POUF").batches
+        assert sofas.available_quantity == 1
+        assert poufs.available_quantity == 7
+        assert bus.uow.committed
+
+    def test_errors_for_invalid_sku(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("b1", "AREALSKU", 100, None))
+
+        with pytest.raises(handlers.InvalidSku, match="Invalid sku NONEXISTENTSKU"):
+            bus.handle(
+                commands.AllocateMany(
+                    [
+                        commands.Allocate("o1", "AREALSKU", 10),
+                        commands.Allocate("o1", "NONEXISTENTSKU", 10),
+                    ]
+                )
+            )
+        [batch] = bus.uow.products.get("AREALSKU").batches
+        assert batch.available_quantity == 100
+
+
 class TestChangeBatchQuantity:
     def test_changes_available_quantity(self):
         bus = bootstrap_test_app()
@@ -120,6 +174,13 @@ class TestChangeBatchQuantity:
         bus.handle(commands.ChangeBatchQuantity("batch1", 50))
         assert batch.available_quantity == 50
 
+    def test_errors_for_unknown_batch(self):
+        bus = bootstrap_test_app()
+        bus.handle(commands.CreateBatch("batch1", "ADORABLE-SETTEE", 100, None))
+
+        with pytest.raises(model.UnknownBatch, match="Unknown batch batch2"):
+            bus.handle(commands.ChangeBatchQuantity("batch2", 50))
+
     def test_reallocates_if_necessary(self):
         bus = bootstrap_test_app()
         history = [
@@ -140,3 +201,155 @@ class TestChangeBatchQuantity:
         assert batch1.available_quantity == 5
         # and 20 will be reallocated to the next batch
         assert batch2.available_quantity == 30
+
+
+class TestHandleMany:
+    def test_handles_every_message_in_order(self):
+        bus = bootstrap_test_app()
+        failures = bus.handle_many(
+            [
+                commands.CreateBatch("batch1", "SQUEAKY-CHAIR", 100, None),
+                commands.Allocate("o1", "SQUEAKY-CHAIR", 10),
+                commands.ChangeBatchQuantity("batch1", 50),
+            ]
+        )
+        assert failures == []
+        [batch] = bus.uow.products.get("SQUEAKY-CHAIR").batches
+        assert batch.available_quantity == 40
+
+    def test_carries_on_after_a_failure(self):
+        bus = bootstrap_test_app()
+        bad_command = commands.Allocate("o1", "NONEXISTENTSKU", 10)
+        [(message, exception)] = bus.handle_many(
+            [
+                commands.CreateBatch("batch1", "SQUEAKY-CHAIR", 100, None),
+                bad_command,
+                commands.Allocate("o2", "SQUEAKY-CHAIR", 10),
+            ]
+        )
+        assert message is bad_command
+        assert isinstance(exception, handlers.InvalidSku)
+        [batch] = bus.uow.products.get("SQUEAKY-CHAIR").batches
+        assert batch.available_quantity == 90
+
+
+class TestAsyncMessageBus:
+    def test_handles_commands_like_the_sync_bus(self):
+        uow = FakeUnitOfWork()
+        bus = bootstrap.bootstrap(
+            start_orm=False,
+            uow=uow,
+            notifications=FakeNotifications(),
+            asynchronous=True,
+        )
+        asyncio.run(
+            bus.handle(commands.CreateBatch("batch1", "SHINY-TRAY", 100, None))
+        )
+        asyncio.run(bus.handle(commands.Allocate("o1", "SHINY-TRAY", 10)))
+
+        [batch] = uow.products.get("SHINY-TRAY").batches
+        assert batch.available_quantity == 90
+        assert uow.committed
+
+    def test_runs_io_bound_event_handlers_concurrently(self):
+        both_sending = threading.Barrier(2, timeout=1)
+        sent = []
+
+        class SlowSMTP:
+            def __init__(self, host, port):
+                pass
+
+            def noop(self):
+                pass
+
+            def sendmail(self, from_addr, to_addrs, msg):
+                both_sending.wait()
+                sent.append(msg)
+
+        with mock.patch("smtplib.SMTP", SlowSMTP):
+            bus = bootstrap.bootstrap(
+                start_orm=False,
+                uow=FakeUnitOfWork(),
+                notifications=notifications.EmailNotifications(),
+                asynchronous=True,
+            )
+            asyncio.run(
+                bus.handle(commands.CreateBatch("batch1", "RARE-PLATE", 1, None))
+            )
+            asyncio.run(
+                bus.handle(
+                    commands.AllocateMany(
+                        [
+                            commands.Allocate("o1", "RARE-PLATE", 5),
+                            commands.Allocate("o2", "RARE-PLATE", 5),
+                        ]
+                    )
+                )
+            )
+
+        assert len(sent) == 2
+        assert all(msg.endswith("Out of stock for RARE-PLATE") for msg in sent)
+
+
+class TestMetrics:
+    def test_records_handler_latency_and_exceptions(self):
+        recorder = metrics.PrometheusMetrics()
+        bus = bootstrap.bootstrap(
+            start_orm=False,
+            uow=FakeUnitOfWork(),
+            notifications=FakeNotifications(),
+            metrics=recorder,
+        )
+        bus.handle(commands.CreateBatch("batch1", "MEASURED-BOWL", 100, None))
+        bus.handle(commands.Allocate("o1", "MEASURED-BOWL", 10))
+        with pytest.raises(handlers.InvalidSku):
+            bus.handle(commands.Allocate("o1", "NONEXISTENTSKU", 10))
+
+        handler_seconds = recorder.histograms["messagebus_handler_seconds"]
+        assert (
+            ("handler", "allocate"),
+            ("message_type", "Allocate"),
+        ) in handler_seconds
+        exceptions = recorder.counters["messagebus_handler_exceptions_total"]
+        assert (
+            exceptions[(("handler", "allocate"), ("message_type", "Allocate"))] == 1
+        )
+        assert recorder.histograms["uow_commit_seconds"][()][-2] == 0
+        assert "messagebus_queue_depth_peak_bucket" in recorder.render()
+
+
+class ContendedUnitOfWork(FakeUnitOfWork):
+    def __init__(self, conflicts):
+        super().__init__()
+        self.conflicts = conflicts
+
+    def _commit(self):
+        if self.conflicts:
+            self.conflicts -= 1
+            raise unit_of_work.ConcurrencyError("version_number changed")
+        super()._commit()
+
+
+class TestConcurrencyRetries:
+    def test_retries_commands_that_hit_a_concurrent_update(self):
+        uow = ContendedUnitOfWork(conflicts=2)
+        bus = bootstrap.bootstrap(
+            start_orm=False, uow=uow, notifications=FakeNotifications()
+        )
+        bus.retry_backoff = 0
+
+        bus.handle(commands.CreateBatch("batch1", "BUSY-LAMP", 100, None))
+
+        assert uow.committed
+        assert uow.conflicts == 0
+
+    def test_gives_up_after_the_last_attempt(self):
+        uow = ContendedUnitOfWork(conflicts=messagebus.RETRY_ATTEMPTS)
+        bus = bootstrap.bootstrap(
+            start_orm=False, uow=uow, notifications=FakeNotifications()
+        )
+        bus.retry_backoff = 0
+
+        with pytest.raises(unit_of_work.ConcurrencyError):
+            bus.handle(commands.CreateBatch("batch1", "BUSY-LAMP", 100, None))
+        assert not uow.committed
@@ -0,0 +1,41 @@
+from allocation.adapters.metrics import PrometheusMetrics
+
+
+def test_renders_histograms_with_cumulative_buckets():
+    metrics = PrometheusMetrics(buckets={"latency_seconds": (0.1, 1)})
+    metrics.observe("latency_seconds", 0.05, handler="allocate")
+    metrics.observe("latency_seconds", 0.5, handler="allocate")
+    metrics.observe("latency_seconds", 5, handler="allocate")
+
+    assert metrics.render().splitlines() == [
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{handler="allocate",le="0.1"} 1',
+        'latency_seconds_bucket{handler="allocate",le="1"} 2',
+        'latency_seconds_bucket{handler="allocate",le="+Inf"} 3',
+        'latency_seconds_sum{handler="allocate"} 5.55',
+        'latency_seconds_count{handler="allocate"} 3',
+    ]
+
+
+def test_renders_counters_per_label_set():
+    metrics = PrometheusMetrics()
+    metrics.increment("errors_total", handler="allocate")
+    metrics.increment("errors_total", handler="allocate")
+    metrics.increment("errors_total", handler='say "hi"')
+
+    assert metrics.render().splitlines() == [
+        "# TYPE errors_total counter",
+        'errors_total{handler="allocate"} 2',
+        'errors_total{handler="say \\"hi\\""} 1',
+    ]
+
+
+def test_gauges_keep_the_last_value():
+    metrics = PrometheusMetrics()
+    metrics.gauge("pool_checked_out", 3)
+    metrics.gauge("pool_checked_out", 1)
+
+    assert metrics.render().splitlines() == [
+        "# TYPE pool_checked_out gauge",
+        "pool_checked_out 1",
+    ]
@@ -1,7 +1,8 @@
+import random
 from datetime import date, timedelta
+import pytest
 from allocation.domain import events
-from allocation.domain.model import Product, OrderLine, Batch
-
+from allocation.domain.model import Product, OrderLine, Batch, UnknownBatch
 
 today = date.today()
 tomorrow = today + timedelta(days=1)
@@ -72,3 +73,204 @@ def test_increments_version_number():
     product.version_number = 7
     product.allocate(line)
     assert product.version_number == 8
+
+
+def test_allocating_a_line_it_already_holds_changes_nothing():
+    batch = Batch("b1", "SCANDI-PEN", 20, eta=None)
+    product = Product(sku="SCANDI-PEN", batches=[batch])
+    line = OrderLine("oref", "SCANDI-PEN", 5)
+    product.allocate(line)
+    product.events.clear()
+
+    assert product.allocate(line) == "b1"
+    assert product.events == []
+    assert product.version_number == 1
+    assert batch.available_quantity == 15
+
+
+def test_skips_batches_with_no_free_capacity():
+    full = Batch("full-batch", "DAINTY-KETTLE", 10, eta=None)
+    spare = Batch("spare-batch", "DAINTY-KETTLE", 100, eta=tomorrow)
+    product = Product(sku="DAINTY-KETTLE", batches=[full, spare])
+    product.allocate(OrderLine("order1", "DAINTY-KETTLE", 10))
+
+    allocation = product.allocate(OrderLine("order2", "DAINTY-KETTLE", 5))
+
+    assert allocation == spare.reference
+    assert full.available_quantity == 0
+
+
+def test_allocates_to_batches_appended_after_creation():
+    shipment = Batch("shipment-batch", "BRASS-HOOK", 100, eta=tomorrow)
+    product = Product(sku="BRASS-HOOK", batches=[shipment])
+    product.allocate(OrderLine("order1", "BRASS-HOOK", 10))
+
+    in_stock = Batch("in-stock-batch", "BRASS-HOOK", 100, eta=None)
+    product.batches.append(in_stock)
+    allocation = product.allocate(OrderLine("order2", "BRASS-HOOK", 10))
+
+    assert allocation == in_stock.reference
+
+
+def test_batch_becomes_allocatable_again_when_quantity_increases():
+    earliest = Batch("speedy-batch", "FOLDING-STOOL", 10, eta=today)
+    latest = Batch("slow-batch", "FOLDING-STOOL", 100, eta=later)
+    product = Product(sku="FOLDING-STOOL", batches=[latest, earliest])
+    product.allocate(OrderLine("order1", "FOLDING-STOOL", 10))
+
+    product.change_batch_quantity("speedy-batch", 20)
+    allocation = product.allocate(OrderLine("order2", "FOLDING-STOOL", 10))
+
+    assert allocation == earliest.reference
+
+
+def make_product_with_batches(sku, quantities_and_etas):
+    return Product(
+        sku=sku,
+        batches=[
+            Batch(f"batch{i}", sku, qty, eta=eta)
+            for i, (qty, eta) in enumerate(quantities_and_etas)
+        ],
+    )
+
+
+def test_allocate_many_matches_sequential_allocation():
+    rng = random.Random(42)
+    batch_specs = [
+        (rng.randint(0, 60), rng.choice([None, today, later])) for _ in range(8)
+    ]
+    lines = [
+        OrderLine(f"order{i}", "BULKY-CRATE", rng.randint(1, 25)) for i in range(80)
+    ]
+    # the same line ordered again, sometimes before its first copy is placed
+    for _ in range(10):
+        lines.insert(rng.randrange(len(lines)), rng.choice(lines))
+    one_by_one = make_product_with_batches("BULKY-CRATE", batch_specs)
+    in_bulk = make_product_with_batches("BULKY-CRATE", batch_specs)
+    # and some the product already holds
+    for line in rng.sample(lines, 10):
+        one_by_one.allocate(line)
+        in_bulk.allocate(line)
+
+    expected = [one_by_one.allocate(line) for line in lines]
+    assert in_bulk.allocate_many(lines) == expected
+    assert in_bulk.events == one_by_one.events
+    assert in_bulk.version_number == one_by_one.version_number
+    assert [b.available_quantity for b in in_bulk.batches] == [
+        b.available_quantity for b in one_by_one.batches
+    ]
+
+
+def test_allocate_many_places_a_repeated_line_like_allocate_does():
+    product = make_product_with_batches("SMALL-TABLE", [(10, None), (10, later)])
+    lines = [
+        OrderLine("order1", "SMALL-TABLE", 4),
+        OrderLine("order1", "SMALL-TABLE", 4),
+        OrderLine("order2", "SMALL-TABLE", 6),
+    ]
+
+    assert product.allocate_many(lines) == ["batch0", "batch0", "batch0"]
+    assert [b.available_quantity for b in product.batches] == [0, 10]
+    assert product.version_number == 2
+
+
+def test_allocate_many_leaves_lines_it_already_holds_where_they_are():
+    product = make_product_with_batches("SMALL-TABLE", [(10, later), (10, None)])
+    held = OrderLine("order1", "SMALL-TABLE", 4)
+    product.allocate(held)
+    product.events.clear()
+
+    assert product.allocate_many([held]) == ["batch1"]
+    assert product.events == []
+    assert product.version_number == 1
+    assert [b.available_quantity for b in product.batches] == [10, 6]
+
+
+def test_allocate_many_records_out_of_stock_for_lines_that_do_not_fit():
+    product = make_product_with_batches("PLAIN-MUG", [(10, None)])
+    lines = [OrderLine("order1", "PLAIN-MUG", 8), OrderLine("order2", "PLAIN-MUG", 5)]
+
+    assert product.allocate_many(lines) == ["batch0", None]
+    assert product.events == [
+        events.Allocated(orderid="order1", sku="PLAIN-MUG", qty=8, batchref="batch0"),
+        events.OutOfStock(sku="PLAIN-MUG"),
+    ]
+
+
+def test_change_batch_quantity_moves_deallocated_lines_to_other_batches():
+    shrinking = Batch("shrinking-batch", "TALL-VASE", 100, eta=None)
+    spare = Batch("spare-batch", "TALL-VASE", 100, eta=tomorrow)
+    product = Product(sku="TALL-VASE", batches=[shrinking, spare])
+    for i, qty in enumerate([10, 10, 10, 50]):
+        product.allocate(OrderLine(f"order{i}", "TALL-VASE", qty))
+    product.events.clear()
+
+    product.change_batch_quantity("shrinking-batch", 60)
+
+    assert product.events == [
+        events.BatchQuantityChanged(
+            ref="shrinking-batch", sku="TALL-VASE", delta=-40
+        ),
+        events.Deallocated(orderid="order3", sku="TALL-VASE", qty=50),
+        events.Allocated(
+            orderid="order3", sku="TALL-VASE", qty=50, batchref="spare-batch"
+        ),
+    ]
+    assert shrinking.available_quantity == 30
+    assert spare.available_quantity == 50
+
+
+def test_change_batch_quantity_moves_only_as_much_as_it_has_to():
+    shrinking = Batch("a", "TALL-VASE", 100, eta=None)
+    spare = Batch("b", "TALL-VASE", 20, eta=tomorrow)
+    product = Product(sku="TALL-VASE", batches=[shrinking, spare])
+    for i, qty in enumerate([10, 50, 30]):
+        product.allocate(OrderLine(f"order{i}", "TALL-VASE", qty))
+    product.events.clear()
+
+    product.change_batch_quantity("a", 85)
+
+    assert product.events == [
+        events.BatchQuantityChanged(ref="a", sku="TALL-VASE", delta=-15),
+        events.Deallocated(orderid="order0", sku="TALL-VASE", qty=10),
+        events.Allocated(orderid="order0", sku="TALL-VASE", qty=10, batchref="b"),
+    ]
+    assert shrinking.available_quantity == 5
+    assert spare.available_quantity == 10
+
+
+def test_change_batch_quantity_records_out_of_stock_if_nowhere_to_reallocate():
+    batch = Batch("batch1", "SHORT-VASE", 20, eta=None)
+    product = Product(sku="SHORT-VASE", batches=[batch])
+    product.allocate(OrderLine("order1", "SHORT-VASE", 20))
+    product.events.clear()
+
+    product.change_batch_quantity("batch1", 10)
+
+    assert product.events == [
+        events.BatchQuantityChanged(ref="batch1", sku="SHORT-VASE", delta=-10),
+        events.Deallocated(orderid="order1", sku="SHORT-VASE", qty=20),
+        events.OutOfStock(sku="SHORT-VASE"),
+    ]
+
+
+def test_change_batch_quantity_finds_batches_added_later():
+    product = Product(sku="PAPER-LANTERN", batches=[])
+    product.add_batch(Batch("batch1", "PAPER-LANTERN", 20, eta=None))
+
+    product.change_batch_quantity("batch1", 5)
+
+    assert product.get_batch("batch1").available_quantity == 5
+    assert product.events == [
+        events.BatchCreated(ref="batch1", sku="PAPER-LANTERN", qty=20),
+        events.BatchQuantityChanged(ref="batch1", sku="PAPER-LANTERN", delta=-15),
+    ]
+
+
+def test_change_batch_quantity_errors_for_unknown_batch():
+    product = Product(
+        sku="PAPER-LANTERN", batches=[Batch("batch1", "PAPER-LANTERN", 20, eta=None)]
+    )
+
+    with pytest.raises(UnknownBatch, match="Unknown batch batch2"):
+        product.change_batch_quantity("batch2", 5)
@@ -0,0 +1,49 @@
+from allocation.adapters.repository import ProductCache, weigh
+from allocation.domain.model import Batch, OrderLine, Product
+
+
+def make_product(sku, batches=1, allocations=0):
+    product = Product(
+        sku, [Batch(f"{sku}-{i}", sku, 100, None) for i in range(batches)]
+    )
+    for i in range(allocations):
+        product.allocate(OrderLine(f"order-{i}", sku, 1))
+    return product
+
+
+def test_weight_counts_product_batches_and_allocations():
+    assert weigh(make_product("LAMP", batches=2, allocations=3)) == 6
+
+
+def test_take_removes_the_product():
+    cache = ProductCache(max_weight=100)
+    product = make_product("LAMP")
+    cache.put(product)
+
+    assert cache.take("LAMP") is product
+    assert cache.take("LAMP") is None
+    assert cache.weight == 0
+
+
+def test_evicts_least_recently_used_over_the_weight_bound():
+    cache = ProductCache(max_weight=6)
+    cache.put(make_product("A"))
+    cache.put(make_product("B"))
+    product = cache.take("A")
+    assert product is not None
+    cache.put(product)
+    cache.put(make_product("C"))
+
+    cache.put(make_product("D"))
+
+    assert cache.take("B") is None
+    assert [sku for sku in "ACD" if cache.take(sku)] == ["A", "C", "D"]
+
+
+def test_replacing_a_product_updates_the_weight():
+    cache = ProductCache(max_weight=100)
+    cache.put(make_product("LAMP"))
+    cache.put(make_product("LAMP", batches=3, allocations=2))
+
+    assert len(cache) == 1
+    assert cache.weight == 6